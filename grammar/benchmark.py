@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import random
+import tempfile
+from copy import deepcopy
+
+from grammar import Gram
+
+
+# 原来的不动点迭代，每轮深拷贝整个集合字典，仅用于对比
+def naive_nullable(g):
+    while True:
+        last_size = len(g.NULLABLE)
+        for idx, X, beta in g.CFG:
+            if beta[0] == '#':
+                g.NULLABLE.add(X)
+            if g.is_non_terminal_list(beta):
+                if g.is_nullable_list(beta):
+                    g.NULLABLE.add(X)
+        if last_size == len(g.NULLABLE):
+            break
+
+
+def naive_first(g):
+    for N in g.NON_TERMINAL:
+        g.FIRST[N] = set()
+    while True:
+        last_set = deepcopy(g.FIRST)
+        for idx, N, beta in g.CFG:
+            for b in beta:
+                if b in g.TERMINAL:
+                    g.FIRST[N].add(b)
+                    break
+                if b in g.NON_TERMINAL:
+                    g.FIRST[N] |= g.FIRST[b]
+                    if b not in g.NULLABLE:
+                        break
+        if last_set == g.FIRST:
+            break
+
+
+def naive_follow(g):
+    for N in g.NON_TERMINAL:
+        g.FOLLOW[N] = set()
+    g.FOLLOW[g.START].add('$')
+    while True:
+        last_set = deepcopy(g.FOLLOW)
+        for idx, N, beta in g.CFG:
+            temp = deepcopy(g.FOLLOW[N])
+            for b in beta[::-1]:
+                if b in g.TERMINAL:
+                    temp = {b}
+                if b in g.NON_TERMINAL:
+                    g.FOLLOW[b] |= temp
+                    if b not in g.NULLABLE:
+                        temp = g.FIRST[b]
+                    else:
+                        temp |= g.FIRST[b]
+        if last_set == g.FOLLOW:
+            break
+    for item in g.FOLLOW.items():
+        if '#' in item[1]:
+            item[1].remove('#')
+
+
+def synthetic_cfg(n, terminals=40, seed=0):
+    # 一条长依赖链加上回边和可空的列表产生式。产生式按链的顺序排列，
+    # FIRST 依赖排在后面的产生式，不动点迭代每轮只能把信息沿链传播一步
+    rnd = random.Random(seed)
+    lines = [f'<S>-><N0>']
+    for i in range(n):
+        nxt = f'<N{i + 1}>' if i + 1 < n else f'[t{i % terminals}]'
+        lines.append(f'<N{i}>->{nxt}<L{i}>')
+        if rnd.random() < 0.1:
+            lines.append(f'<N{i}>->[#]')
+        if i >= 8 and rnd.random() < 0.2:
+            lines.append(f'<N{i}>->[t{rnd.randrange(terminals)}]<N{rnd.randrange(i - 8, i)}>')
+        lines.append(f'<L{i}>->[t{rnd.randrange(terminals)}]<L{i}>')
+        lines.append(f'<L{i}>->[#]')
+    return '\n'.join(lines) + '\n'
+
+
+def empty_gram(path):
+    g = Gram.__new__(Gram)
+    g.TERMINAL = set()
+    g.NON_TERMINAL = set()
+    g.NULLABLE = set()
+    g.FIRST = dict()
+    g.FOLLOW = dict()
+    g.FIRST_S = dict()
+    g.FIRST_S_BITS = dict()
+    g.CFG = list()
+    g.ANA_TABLE = dict()
+    g.DFG_HASH = dict()
+    g.START = ''
+    g.init_cfg(path)
+    return g
+
+
+def measure(path, naive):
+    g = empty_gram(path)
+    t = time.perf_counter()
+    if naive:
+        naive_nullable(g)
+        naive_first(g)
+        naive_follow(g)
+    else:
+        g.init_symbols()
+        g.init_nullable()
+        g.init_first()
+        g.init_follow()
+        g.init_views()
+    return time.perf_counter() - t, g
+
+
+def run(sizes, max_naive):
+    print('{:>8} {:>8} {:>12} {:>12}'.format('NT', 'P', 'naive(s)', 'scc(s)'))
+    for n in sizes:
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf8') as f:
+            f.write(synthetic_cfg(n))
+        try:
+            fast, g = measure(f.name, False)
+            slow = '-'
+            if n <= max_naive:
+                cost, ref = measure(f.name, True)
+                assert (g.NULLABLE, g.FIRST, g.FOLLOW) == (ref.NULLABLE, ref.FIRST, ref.FOLLOW)
+                slow = f'{cost:.3f}'
+            print('{:>8} {:>8} {:>12} {:>12.3f}'.format(len(g.NON_TERMINAL), len(g.CFG), slow, fast))
+        finally:
+            os.remove(f.name)
+
+
+if __name__ == '__main__':
+    # python benchmark.py [最大规模] [对比旧实现的最大规模]
+    top = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    max_naive = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    sizes = [n for n in (50, 100, 250, 500, 1000, 2000, 5000, 10000) if n <= top]
+    run(sizes, max_naive)
@@ -0,0 +1,54 @@
+from collections.abc import Mapping, Set
+
+
+def iter_bits(mask):
+    # 从低到高依次给出掩码中为 1 的位的下标
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class BitSet(Set):
+    # 整数位掩码上的只读集合视图，第 i 位对应 table.names[i]，table 为 KindTable
+    __slots__ = ('mask', 'table')
+
+    def __init__(self, mask, table):
+        self.mask = mask
+        self.table = table
+
+    def __contains__(self, name):
+        i = self.table.ids.get(name)
+        return i is not None and self.mask >> i & 1 == 1
+
+    def __iter__(self):
+        names = self.table.names
+        for i in iter_bits(self.mask):
+            yield names[i]
+
+    def __len__(self):
+        return bin(self.mask).count('1')
+
+    def __repr__(self):
+        return repr(set(self)) if self.mask else 'set()'
+
+
+class BitSetMap(Mapping):
+    # 键到位掩码的字典的只读视图，取值时包装为 BitSet
+    __slots__ = ('masks', 'table')
+
+    def __init__(self, masks, table):
+        self.masks = masks
+        self.table = table
+
+    def __getitem__(self, key):
+        return BitSet(self.masks[key], self.table)
+
+    def __iter__(self):
+        return iter(self.masks)
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __repr__(self):
+        return '{' + ', '.join(f'{k!r}: {v!r}' for k, v in self.items()) + '}'
@@ -1,5 +1,11 @@
 import sys
+import os
 import re
+import hashlib
+import marshal
+import zlib
+import gc
+from array import array
 import pandas as pd
 import numpy as np
 
@@ -7,9 +13,24 @@ sys.path.append('../lexical')
 sys.path.append('../utils')
 from log import Log
 from lexical import Lex
-from copy import deepcopy
+from token_stream import KindTable
+from bitset import BitSet, BitSetMap, iter_bits
 
 logger = Log("./logs/log.txt")
+# 预测分析表缓存的格式版本，表的内容或计算方式改变时加一
+TABLE_FORMAT = 2
+TABLE_MAGIC = b'LL1\x00'
+# 二进制分析树文件的格式版本
+TREE_FORMAT = 1
+TREE_MAGIC = b'TRE\x00'
+# 整数预测分析表中的保留值，其余的值为产生式编号
+TABLE_ERROR = -1
+TABLE_SYNCH = -2
+# 跟踪记录中栈顶为终结符时的动作：匹配移进、不匹配弹出
+TRACE_SHIFT = -3
+TRACE_MISMATCH = -4
+# 一次分析最多报告的语法错误数，超过后停止分析
+MAX_PARSE_ERRORS = 100
 pd.set_option('display.max_columns', None)
 # 显示所有行
 pd.set_option('display.max_rows', None)
@@ -57,16 +78,32 @@ def get_test_tokens(filename='../lexical/full_test.cpp'):
     return tokens
 
 
+def iter_test_tokens(filename='../lexical/full_test.cpp', chunk_size=1 << 16):
+    # 流式读取源文件，供 Gram.parse 逐个消费
+    lex = Lex()
+    yield from lex.iter_tokens(filename, chunk_size=chunk_size)
+    yield '$', '', ''
+
+
+def get_test_token_stream(filename='../lexical/full_test.cpp', kinds=None):
+    # 紧凑的列式记号流，kinds 通常传入 Gram.KINDS 以共享终结符编号
+    lex = Lex()
+    stream = lex.create_token_stream(filename, kinds)
+    stream.append(('$', '', ''))
+    return stream
+
+
 class Node:
-    cur_id = 0
+    # 分析大文件时会创建大量结点，使用 __slots__ 减少内存和创建开销
+    # 结点编号由建树的一方给出（每棵树从 1 开始），语义分析用它生成标号
+    __slots__ = ('data', 'child', 'symbol', 'pos', 'id')
 
-    def __init__(self, data, symbol=None, pos=None):
+    def __init__(self, data, symbol=None, pos=None, id=0):
         self.data = data
         self.child = []
         self.symbol = symbol
         self.pos = pos
-        self.id = Node.cur_id + 1
-        Node.cur_id += 1
+        self.id = id
 
     def __repr__(self):
         return "data: {} symbol: {} child_size: {}".format(self.data, self.symbol, len(self.child))
@@ -84,7 +121,6 @@ class Node:
 class Tree:
     def __init__(self, root=None):
         self.root = root
-        self.info = []
 
     def bfs(self):
         queue = [self.root]
@@ -102,23 +138,219 @@ class Tree:
     def print(self):
         self.dfs_showdir(self.root, 0)
 
+    def to_records(self):
+        # 先序展开为 (data, symbol, pos, id, 孩子数) 五个平行列表，便于序列化
+        datas, symbols, positions, ids, sizes = [], [], [], [], []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            datas.append(node.data)
+            symbols.append(node.symbol)
+            positions.append(node.pos)
+            ids.append(node.id)
+            sizes.append(len(node.child))
+            stack.extend(reversed(node.child))
+        return datas, symbols, positions, ids, sizes
+
+    @classmethod
+    def from_records(cls, records):
+        # to_records 的逆过程，保留结点编号（语义分析用它生成标号）
+        datas, symbols, positions, ids, sizes = records
+        tree = cls()
+        stack = []
+        for data, symbol, pos, node_id, size in zip(datas, symbols, positions, ids, sizes):
+            node = Node(data, symbol, pos, node_id)
+            if stack:
+                parent = stack[-1]
+                parent[0].child.append(node)
+                parent[1] -= 1
+                if parent[1] == 0:
+                    stack.pop()
+            else:
+                tree.root = node
+            if size:
+                stack.append([node, size])
+        return tree
+
+    def to_binary(self):
+        # 紧凑的二进制格式：符号用名字表中的下标表示，结点编号和有记号的叶子的下标按差分保存，
+        # 与孩子数一起存为小端序的 int32 数组；只为有记号的叶子保存属性值和位置，整体用 zlib 压缩
+        datas, symbols, positions, ids, sizes = self.to_records()
+        names = list(dict.fromkeys(datas))
+        index = {name: i for i, name in enumerate(names)}
+        leaves = [i for i, (symbol, pos) in enumerate(zip(symbols, positions)) if symbol is not None or pos is not None]
+        columns = (np.array([index[d] for d in datas]), np.array(sizes),
+                   np.diff(np.array(ids), prepend=0), np.diff(np.array(leaves), prepend=0))
+        payload = (TREE_FORMAT, names, *(c.astype('<i4').tobytes() for c in columns),
+                   [symbols[i] for i in leaves], [positions[i] for i in leaves])
+        return TREE_MAGIC + zlib.compress(marshal.dumps(payload, 4), 1)
+
+    @classmethod
+    def from_binary(cls, data):
+        # to_binary 的逆过程，得到由 Node 组成的树，结点编号不变
+        if data[:len(TREE_MAGIC)] != TREE_MAGIC:
+            raise ValueError('not a binary tree file')
+        try:
+            payload = marshal.loads(zlib.decompress(data[len(TREE_MAGIC):]))
+        except (zlib.error, EOFError, ValueError, TypeError):
+            raise ValueError('corrupted binary tree file')
+        if payload[0] != TREE_FORMAT:
+            raise ValueError(f'unsupported binary tree format {payload[0]}')
+        names = payload[1]
+        syms, sizes, ids, leaves = (np.frombuffer(raw, '<i4') for raw in payload[2:6])
+        symbols = [None] * len(syms)
+        positions = [None] * len(syms)
+        for i, symbol, pos in zip(np.cumsum(leaves).tolist(), payload[6], payload[7]):
+            symbols[i] = symbol
+            positions[i] = pos
+        datas = [names[k] for k in syms.tolist()]
+        return cls.from_records((datas, symbols, positions, np.cumsum(ids).tolist(), sizes.tolist()))
+
+    def save_binary(self, path):
+        with open(path, 'wb') as fw:
+            fw.write(self.to_binary())
+
+    @classmethod
+    def load_binary(cls, path):
+        with open(path, 'rb') as fr:
+            return cls.from_binary(fr.read())
+
+    def iter_lines(self, node, depth=0, color=False):
+        # 逐行产生以 node 为根的子树（不含 node 本身）的文本，不保存已产生的行。
+        # 列表类产生式是右递归的，树的深度随语句数增长，用显式栈做先序遍历
+        stack = [(item, depth) for item in reversed(node.child)]
+        while stack:
+            item, depth = stack.pop()
+            child = item.child
+            leaf = len(child) == 0
+            if item.data == '#':
+                info = ''
+            elif not leaf:
+                info = item.data
+            elif color:
+                info = f' {Color.red_bold(item.data)} {Color.blue_underline(str(item.symbol))}'
+            else:
+                info = f' {item.data} @ {item.symbol}'
+            yield "|      " * depth + "|--" + info
+            if not leaf:
+                stack.extend((c, depth + 1) for c in reversed(child))
+
+    def write(self, fw):
+        # 把不带颜色的文本流式写入打开的文件
+        for line in self.iter_lines(self.root):
+            fw.write(line)
+            fw.write('\n')
+
     def save(self, save_path="./result/tree"):
-        fw = open(save_path, encoding='utf8', mode='w')
-        for i in self.info:
-            fw.write(i + '\n')
-        fw.close()
+        with open(save_path, encoding='utf8', mode='w') as fw:
+            self.write(fw)
 
     def dfs_showdir(self, node, depth):
         if depth == 0:
             print("root:[" + node.data + "]")
-        for item in node.child:
-            leaf = len(item.child) == 0
-            raw_info = '' if item.data == '#' else f' {item.data} @ {item.symbol}' if leaf else item.data
-            info = '' if item.data == '#' else f' {Color.red_bold(item.data)} {Color.blue_underline(str(item.symbol))}' if leaf else item.data
-            print("|      " * depth + "|--" + info)
-            self.info.append("|      " * depth + "|--" + raw_info)
-            if not leaf:
-                self.dfs_showdir(item, depth + 1)
+        for line in self.iter_lines(node, depth, color=True):
+            print(line)
+
+
+class NodeView:
+    # ArrayTree 中一个结点的轻量视图，提供与 Node 相同的访问方式（child、data、symbol、pos、id）
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __repr__(self):
+        return "data: {} symbol: {} child_size: {}".format(self.data, self.symbol, len(self.child))
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    @property
+    def data(self):
+        return self.tree.names[self.tree.syms[self.index]]
+
+    @property
+    def symbol(self):
+        k = self.tree.tokens[self.index]
+        return None if k < 0 else self.tree.attrs[k]
+
+    @property
+    def pos(self):
+        k = self.tree.tokens[self.index]
+        return None if k < 0 else self.tree.positions[k]
+
+    @property
+    def id(self):
+        return self.index + 1
+
+    @property
+    def child(self):
+        tree = self.tree
+        res = []
+        k = tree.first[self.index]
+        while k >= 0:
+            res.append(NodeView(tree, k))
+            k = tree.next[k]
+        return res
+
+    @property
+    def parent(self):
+        k = self.tree.parent[self.index]
+        return None if k < 0 else NodeView(self.tree, k)
+
+    def is_terminal(self):
+        return self.tree.first[self.index] < 0
+
+    def is_valid(self):
+        return self.data != '#'
+
+
+class ArrayTree(Tree):
+    # 以平行数组保存的分析树：结点下标即创建顺序，编号为下标加一。
+    # syms 为符号编号（names 中的下标），tokens 为移进的记号序号（attrs、positions 中的下标，非叶子为 -1），
+    # first、next、parent 分别为第一个孩子、右兄弟和父结点的下标（没有时为 -1）
+    def __init__(self, names):
+        super().__init__()
+        self.names = names
+        self.syms = array('i')
+        self.tokens = array('i')
+        self.first = array('i')
+        self.next = array('i')
+        self.parent = array('i')
+        self.attrs = []
+        self.positions = []
+
+    def __len__(self):
+        return len(self.syms)
+
+    def node(self, index):
+        return NodeView(self, index)
+
+    def to_records(self):
+        datas, symbols, positions, ids, sizes = [], [], [], [], []
+        if self.root is None:
+            return datas, symbols, positions, ids, sizes
+        names, syms, tokens, first, nxt = self.names, self.syms, self.tokens, self.first, self.next
+        stack = [self.root.index]
+        while stack:
+            i = stack.pop()
+            k = tokens[i]
+            datas.append(names[syms[i]])
+            symbols.append(None if k < 0 else self.attrs[k])
+            positions.append(None if k < 0 else self.positions[k])
+            ids.append(i + 1)
+            children = []
+            c = first[i]
+            while c >= 0:
+                children.append(c)
+                c = nxt[c]
+            sizes.append(len(children))
+            stack.extend(reversed(children))
+        return datas, symbols, positions, ids, sizes
 
 
 class Stack:
@@ -147,29 +379,172 @@ class Stack:
         return len(self.stack) == 1 and self.stack[0] == '$'
 
 
+def scc_order(nodes, deps):
+    # 非递归的 Tarjan 算法，按依赖在前的顺序返回强连通分量
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    order = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(deps[root]))]
+        while work:
+            v, it = work[-1]
+            for w in it:
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(deps[w])))
+                    break
+                if w in on_stack and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                work.pop()
+                if work and low[v] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[v]
+                if low[v] == index[v]:
+                    comp = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.remove(w)
+                        comp.append(w)
+                        if w == v:
+                            break
+                    order.append(comp)
+    return order
+
+
+def solve_inclusion(nodes, deps, const):
+    # 求 X(N) = const(N) ∪ ⋃ X(d), d ∈ deps(N) 的最小解
+    # 集合用整数位掩码表示，同一强连通分量中的集合必然相等，合并后按拓扑序求一次即可，每条依赖边只做一次并集
+    result = {}
+    for comp in scc_order(nodes, deps):
+        members = set(comp)
+        acc = 0
+        for N in comp:
+            acc |= const[N]
+            for d in deps[N]:
+                if d not in members:
+                    acc |= result[d]
+        for N in comp:
+            result[N] = acc
+    return result
+
+
 class Gram:
 
-    def __init__(self, filepath='./cfg.txt') -> None:
+    def __init__(self, filepath='./cfg.txt', table_cache=True) -> None:
         self.TERMINAL = set()
         self.NON_TERMINAL = set()
-        self.NULLABLE = set()
-        self.FIRST = dict()
-        self.FOLLOW = dict()
-        self.FIRST_S = dict()
+        # 终结符按 KINDS 中的编号、非终结符按 NT_KINDS 中的编号对应到整数的各个位
+        self.NULLABLE_BITS = 0
+        self.FIRST_BITS = dict()
+        self.FOLLOW_BITS = dict()
+        self.FIRST_S_BITS = dict()
         self.CFG = list()
         self.ANA_TABLE = dict()
         self.ERRORS = list()
         self.DFG_HASH = dict()
         self.START = ''
-        self.init_cfg(filepath)
-        self.init_nullable()
-        self.init_first()
-        self.init_follow()
-        self.init_first_s()
-        self.init_table()
+        # 文法文件不变时直接读入上次计算好的各个集合和预测分析表
+        cache_path = self.table_cache_path(filepath) if table_cache else None
+        if cache_path is None or not self.load_tables(cache_path):
+            self.init_cfg(filepath)
+            self.init_symbols()
+            self.init_nullable()
+            self.init_first()
+            self.init_follow()
+            self.init_first_s()
+            self.init_table()
+            self.create_analysis_table()
+            if cache_path is not None:
+                self.save_tables(cache_path)
+        self.init_views()
+        self.compiled = CompiledGrammar(self)
         self.tree = Tree()
         self.err = False
 
+    def table_cache_path(self, filepath):
+        # 缓存放在文法文件旁的 .ll1 目录中，以文法文件内容的哈希命名
+        try:
+            with open(filepath, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        except OSError:
+            return None
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        return os.path.join(os.path.dirname(filepath), '.ll1', f'{name}.{digest}.bin')
+
+    def load_tables(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+        if data[:len(TABLE_MAGIC)] != TABLE_MAGIC:
+            return False
+        try:
+            tables = marshal.loads(data[len(TABLE_MAGIC):])
+        except (EOFError, ValueError, TypeError):
+            return False
+        if tables.get('format') != TABLE_FORMAT:
+            return False
+        # marshal 按原来的迭代顺序写出集合和字典，读回后顺序不变
+        self.START = tables['start']
+        self.TERMINAL = tables['terminal']
+        self.NON_TERMINAL = tables['non_terminal']
+        self.CFG = tables['cfg']
+        self.DFG_HASH = {int(p[0]): p for p in self.CFG}
+        self.init_symbols()
+        self.NULLABLE_BITS = tables['nullable']
+        self.FIRST_BITS = tables['first']
+        self.FOLLOW_BITS = tables['follow']
+        self.FIRST_S_BITS = tables['first_s']
+        self.ANA_TABLE = tables['table']
+        return True
+
+    def save_tables(self, path):
+        tables = {
+            'format': TABLE_FORMAT,
+            'start': self.START,
+            'terminal': self.TERMINAL,
+            'non_terminal': self.NON_TERMINAL,
+            'cfg': self.CFG,
+            'nullable': self.NULLABLE_BITS,
+            'first': self.FIRST_BITS,
+            'follow': self.FOLLOW_BITS,
+            'first_s': self.FIRST_S_BITS,
+            'table': self.ANA_TABLE,
+        }
+        data = TABLE_MAGIC + marshal.dumps(tables, 4)
+        # 写入临时文件后改名，多个进程同时构建时不会读到写了一半的文件；目录不可写时跳过
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def init_symbols(self):
+        # 终结符编号与记号类别编号一致，'$' 为 0
+        self.KINDS = KindTable(['$'] + sorted(self.TERMINAL))
+        self.NT_KINDS = KindTable(dict.fromkeys(p[1] for p in self.CFG))
+        self.EPSILON_BIT = 1 << self.KINDS.ids['#'] if '#' in self.KINDS else 0
+
+    def init_views(self):
+        # 以集合的形式只读地访问各个位掩码，供打印和外部代码使用
+        self.NULLABLE = BitSet(self.NULLABLE_BITS, self.NT_KINDS)
+        self.FIRST = BitSetMap(self.FIRST_BITS, self.KINDS)
+        self.FOLLOW = BitSetMap(self.FOLLOW_BITS, self.KINDS)
+        self.FIRST_S = BitSetMap(self.FIRST_S_BITS, self.KINDS)
+
     def print_tree(self, save=None):
         self.tree.print()
         if save:
@@ -220,94 +595,125 @@ class Gram:
         return True
 
     def init_nullable(self):
-        while True:
-            last_size = len(self.NULLABLE)
-            for idx, X, beta in self.CFG:
-                if beta[0] == '#':
-                    self.NULLABLE.add(X)
-                if self.is_non_terminal_list(beta):
-                    if self.is_nullable_list(beta):
-                        self.NULLABLE.add(X)
-            if last_size == len(self.NULLABLE):
-                break
+        # 对全由非终结符组成的产生式记录尚未确定可空的符号个数，某个符号可空时只更新出现它的产生式
+        nt = self.NT_KINDS.ids
+        nullable = 0
+        count = []
+        occurs = {N: [] for N in self.NON_TERMINAL}
+        work = []
+        for idx, X, beta in self.CFG:
+            if beta[0] == '#':
+                if not nullable >> nt[X] & 1:
+                    nullable |= 1 << nt[X]
+                    work.append(X)
+            if self.is_non_terminal_list(beta):
+                k = len(count)
+                count.append(len(beta))
+                for b in beta:
+                    occurs[b].append((k, X))
+        while work:
+            b = work.pop()
+            for k, X in occurs[b]:
+                count[k] -= 1
+                if count[k] == 0 and not nullable >> nt[X] & 1:
+                    nullable |= 1 << nt[X]
+                    work.append(X)
+        self.NULLABLE_BITS = nullable
+
+    def is_nullable(self, N):
+        return self.NULLABLE_BITS >> self.NT_KINDS.ids[N] & 1 == 1
 
     def init_first(self):
-        for N in self.NON_TERMINAL:
-            self.FIRST[N] = set()
-        while True:
-            last_set = deepcopy(self.FIRST)
-            for idx, N, beta in self.CFG:
-                for b in beta:
-                    if b in self.TERMINAL:
-                        self.FIRST[N].add(b)
+        # FIRST(N) 包含产生式右部可空前缀中的终结符，以及前缀中非终结符的 FIRST，
+        # 依赖关系构成图，按强连通分量的拓扑序各求一次
+        t = self.KINDS.ids
+        const = {N: 0 for N in self.NON_TERMINAL}
+        deps = {N: [] for N in self.NON_TERMINAL}
+        for idx, N, beta in self.CFG:
+            for b in beta:
+                if b in self.TERMINAL:
+                    const[N] |= 1 << t[b]
+                    break
+                if b in self.NON_TERMINAL:
+                    deps[N].append(b)
+                    if not self.is_nullable(b):
                         break
-                    if b in self.NON_TERMINAL:
-                        self.FIRST[N] |= self.FIRST[b]
-                        if b not in self.NULLABLE:
-                            break
-            if last_set == self.FIRST:
-                break
+        self.FIRST_BITS = solve_inclusion(self.NON_TERMINAL, deps, const)
 
     def create_analysis_table(self):
+        names = self.KINDS.names
         for p in self.CFG:
             idx, A, beta = p
-            for b in self.FIRST_S[idx]:
-                if b != '#':
-                    self.ANA_TABLE[A][b].add(idx)
-
-            if '#' in self.FIRST_S[idx]:
-                for b in self.FOLLOW[A]:
-                    if b != '#':
-                        # print(p)
-                        self.ANA_TABLE[A][b].add(idx)
+            row = self.ANA_TABLE[A]
+            first_s = self.FIRST_S_BITS[idx]
+            look = first_s & ~self.EPSILON_BIT
+            if first_s & self.EPSILON_BIT:
+                look |= self.FOLLOW_BITS[A]
+            for b in iter_bits(look):
+                row[names[b]].add(idx)
         for NT in self.NON_TERMINAL:
-            for b in self.FOLLOW[NT]:
-                if len(self.ANA_TABLE[NT][b]) == 0:
-                    self.ANA_TABLE[NT][b].add('synch')
+            row = self.ANA_TABLE[NT]
+            for b in iter_bits(self.FOLLOW_BITS[NT]):
+                if len(row[names[b]]) == 0:
+                    row[names[b]].add('synch')
+
+    def conflicts(self):
+        # 同一非终结符的两个产生式的 FIRST_S 相交即为 LL(1) 冲突，
+        # 返回 (非终结符, 后一个产生式编号, 冲突的终结符)
+        res = []
+        seen = dict()
+        for idx, A, beta in self.CFG:
+            first_s = self.FIRST_S_BITS[idx] & ~self.EPSILON_BIT
+            prev = seen.get(A, 0)
+            if prev & first_s:
+                res.append((A, idx, BitSet(prev & first_s, self.KINDS)))
+            seen[A] = prev | first_s
+        return res
 
     def init_follow(self):
-        for N in self.NON_TERMINAL:
-            self.FOLLOW[N] = set()
-        self.FOLLOW[self.START].add('$')
-        while True:
-            last_set = deepcopy(self.FOLLOW)
-            for idx, N, beta in self.CFG:
-                # ERROR HERE
-                temp = deepcopy(self.FOLLOW[N])
-                for b in beta[::-1]:
-                    if b in self.TERMINAL:
-                        temp = {b}
-                    if b in self.NON_TERMINAL:
-                        # if b == 'E':
-                        #     print('[DEBUG]', self.FOLLOW[b], N, beta, temp)
-                        # print("temp p", N, beta, '      b', b, temp)
-                        self.FOLLOW[b] |= temp
-                        if b not in self.NULLABLE:
-                            temp = self.FIRST[b]
-                        else:
-                            temp |= self.FIRST[b]
-            if last_set == self.FOLLOW:
-                break
-        for item in self.FOLLOW.items():
-            if '#' in item[1]:
-                item[1].remove('#')
+        # 从右向左扫描产生式右部：非终结符的 FOLLOW 包含其后可空后缀的 FIRST，
+        # 后缀全部可空时还包含左部的 FOLLOW，同样按强连通分量求解
+        t = self.KINDS.ids
+        const = {N: 0 for N in self.NON_TERMINAL}
+        deps = {N: [] for N in self.NON_TERMINAL}
+        const[self.START] |= 1 << t['$']
+        for idx, N, beta in self.CFG:
+            temp = 0
+            tail = True
+            for b in beta[::-1]:
+                if b in self.TERMINAL:
+                    temp = 1 << t[b]
+                    tail = False
+                if b in self.NON_TERMINAL:
+                    const[b] |= temp
+                    if tail:
+                        deps[b].append(N)
+                    if not self.is_nullable(b):
+                        temp = self.FIRST_BITS[b]
+                        tail = False
+                    else:
+                        temp |= self.FIRST_BITS[b]
+        follow = solve_inclusion(self.NON_TERMINAL, deps, const)
+        self.FOLLOW_BITS = {N: m & ~self.EPSILON_BIT for N, m in follow.items()}
 
     def calculate_first_s(self, p):
         idx, N, beta = p
+        t = self.KINDS.ids
+        first_s = 0
         for b in beta:
             if b in self.TERMINAL:
-                self.FIRST_S[idx].add(b)
+                first_s |= 1 << t[b]
                 if b != '#':
+                    self.FIRST_S_BITS[idx] = first_s
                     return
             if b in self.NON_TERMINAL:
-                self.FIRST_S[idx] |= self.FIRST[b]
-                if b not in self.NULLABLE:
+                first_s |= self.FIRST_BITS[b]
+                if not self.is_nullable(b):
+                    self.FIRST_S_BITS[idx] = first_s
                     return
-        self.FIRST_S[idx] |= self.FOLLOW[N]
+        self.FIRST_S_BITS[idx] = first_s | self.FOLLOW_BITS[N]
 
     def init_first_s(self):
-        for idx, x, beta in self.CFG:
-            self.FIRST_S[idx] = set()
         for p in self.CFG:
             self.calculate_first_s(p)
 
@@ -346,60 +752,28 @@ class Gram:
         for idx, p in self.DFG_HASH.items():
             print(idx, p[1], '->', p[2])
 
-    def parse(self, tokens, pr=True):
-        logger.debug('-' * 100)
-        self.create_analysis_table()
-        # self.print_table()
-        self.tree.root = Node(self.START)
-        curr_node = self.tree.root
-        stack = Stack()
-        stack.push(Node('$'))
-        stack.push(curr_node)
-        i = 0
-
-        while not stack.empty():
-            if i >= len(tokens):
-                logger.error("illegal end of program")
-                return
-            if pr: print('[STACK] {:80}\t [INPUT] {:40}'.format(stack.info(), tokens[i][0]), end='\t')
-
-            node_t = stack.top()
-            t = node_t.data
-            if t in self.TERMINAL and t != '#' or t == '$':
-                if t == tokens[i][0]:
-                    node_t.symbol = tokens[i][1]
-                    node_t.pos = tokens[i][2]
-                    i += 1
-                    if pr: print()
-                    # print('[DEBUG] solve', t, 'now i = ', i)
-                    stack.pop()
-                else:
-                    logger.error(f'at line {tokens[i][2]},  expected {t} but received {tokens[i][0]}, move pointer')
-                    self.err = True
-                    stack.pop()
-            else:
-                ich = tokens[i][0]
-                table_item = self.ANA_TABLE[t][ich]
-                if len(table_item) == 0:
-                    # logger.error(f'at line {tokens[i][2]}, cannot parse {t} when receiving {ich}, pop {t}')
-                    self.proc_parse_error(tokens[i], t)
-                    i += 1
-                    continue
-                if list(table_item)[0] == 'synch':
-                    self.proc_parse_error(tokens[i], t)
-                    # logger.error(f'at line {tokens[i][2]}, cannot parse {t} when receiving {ich}, pop {t}')
-                    stack.pop()
-                    continue
-                stack.pop()
-                unique_dfg_id = int(list(table_item)[0])
-                _, dfg_l, dfg_r = self.DFG_HASH[unique_dfg_id]
-                curr_node = node_t
-                for ch in dfg_r[::-1]:
-                    ch_node = Node(ch)
-                    curr_node.add_child(ch_node)
-                    if ch != '#':
-                        stack.push(ch_node)
-                if pr: print('[OUTPUT]', self.DFG_HASH[unique_dfg_id])
+    def parse(self, tokens, pr=True, compact=False, handler=None, trace=None, max_errors=MAX_PARSE_ERRORS):
+        # 使用整数表驱动的编译模式，compact 为 True 时得到 ArrayTree
+        # 结果保存在 self.tree 和 self.err 中；需要多次或并发分析时直接使用 self.compiled.parse
+        # 给出 handler 时不建树，只把分析事件依次交给 handler（见 CompiledGrammar.iter_events）
+        # 给出 trace（ParseTrace）时记录最近的分析步骤，出错时写入日志；pr 为 True 时总是跟踪并打印
+        # 语法错误达到 max_errors 个时停止分析
+        if handler is not None:
+            result = self.compiled.parse_events(tokens, handler, max_errors)
+            if result.err:
+                self.err = True
+            return result
+        if pr and trace is None:
+            trace = ParseTrace()
+        result = self.compiled.parse(tokens, compact, trace, max_errors)
+        self.tree = result.tree
+        if result.err:
+            self.err = True
+        if pr:
+            trace.dump(self.compiled)
+        elif trace is not None and result.errors:
+            trace.dump(self.compiled, logger.error)
+        return result
 
     def error(self, l, i, info):
         print(f"\n[ERROR] at line {l}, char at {i} of total, {info}")
@@ -412,15 +786,428 @@ class Gram:
 
         return res
 
-    def proc_parse_error(self, token, nt):
-        # [(]<参数声明>[)]<函数实现>
-        self.err = True
-        if nt == '赋初值' and token[0] == '(':
-            logger.error(
-                f'at position {token[2]}, when parsing {nt}, expected {self.get_valid_token(nt)}, but received [{token[0]}] (Nested definitions are not allowed)')
-        else:
-            logger.error(f'at position {token[2]}, when parsing {nt}, expected {self.get_valid_token(nt)}, but '
-                         f'received [{token[0]}]')
+
+def parse_error_message(token, nt, expected):
+    # [(]<参数声明>[)]<函数实现>
+    if nt == '赋初值' and token[0] == '(':
+        return f'at position {token[2]}, when parsing {nt}, expected {expected}, but received [{token[0]}] (Nested definitions are not allowed)'
+    return f'at position {token[2]}, when parsing {nt}, expected {expected}, but received [{token[0]}]'
+
+
+class ParseTrace:
+    # 固定大小的环形缓冲区，保存最近 size 步的 (栈顶符号编号, 向前看记号类别, 产生式编号)，
+    # 步数由记录的总数推出。产生式编号为 TRACE_SHIFT、TRACE_MISMATCH、TABLE_ERROR、TABLE_SYNCH 时表示相应的动作
+    __slots__ = ('size', 'buf', 'steps')
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.buf = array('i', bytes(12 * size))
+        self.steps = 0
+
+    def record(self, top, kind, prod):
+        i = self.steps % self.size * 3
+        buf = self.buf
+        buf[i] = top
+        buf[i + 1] = kind
+        buf[i + 2] = prod
+        self.steps += 1
+
+    def records(self):
+        # 按时间顺序给出缓冲区中的 (步数, 栈顶, 向前看, 产生式)
+        buf = self.buf
+        for step in range(max(0, self.steps - self.size), self.steps):
+            i = step % self.size * 3
+            yield step, buf[i], buf[i + 1], buf[i + 2]
+
+    def dump(self, compiled, write=print):
+        names = compiled.symbols
+        actions = {TRACE_SHIFT: 'match', TRACE_MISMATCH: 'mismatch, pop', TABLE_ERROR: 'error, skip to sync',
+                   TABLE_SYNCH: 'synch, pop'}
+        for step, top, kind, prod in self.records():
+            if prod >= 0:
+                action = f'{names[top]} -> {" ".join(reversed(compiled.rhs_names[prod]))}'
+            else:
+                action = actions[prod]
+            look = names[kind] if kind >= 0 else '?'
+            write(f'[TRACE] {step:>8} [TOP] {names[top]:20} [INPUT] {look:10} [OUTPUT] {action}')
+
+
+class ParseAborted(Exception):
+    pass
+
+
+class ParseResult:
+    # 一次分析的全部结果：分析树、是否出错以及按顺序记录的错误信息
+    # 错误数达到 max_errors 时抛出 ParseAborted，分析循环中不需要另外计数
+    __slots__ = ('tree', 'err', 'errors', 'max_errors')
+
+    def __init__(self, tree=None, max_errors=MAX_PARSE_ERRORS):
+        self.tree = tree
+        self.err = False
+        self.errors = []
+        self.max_errors = max_errors
+
+    def error(self, info, err=True):
+        logger.error(info)
+        self.errors.append(info)
+        if err:
+            self.err = True
+            if len(self.errors) >= self.max_errors:
+                raise ParseAborted
+
+    def abort(self):
+        self.error(f'too many syntax errors, stop after {len(self.errors)}', err=False)
+
+
+class CompiledGrammar:
+    # Gram 编译后的只读分析器：符号编为小整数（终结符沿用 KINDS 的编号，非终结符排在其后），
+    # table[(非终结符编号 - 终结符个数) * 终结符个数 + 终结符编号] 为产生式编号或保留值。
+    # 构造后不再修改，parse 的状态全部在调用内部，同一个对象可以在多个线程中同时使用
+    __slots__ = ('start', 'symbols', 'kinds', 'start_id', 'end_id', 'table', 'rhs', 'rhs_names', 'rhs_ids',
+                 'rhs_sizes', 'push_offsets', 'expected', 'sync')
+
+    def __init__(self, gram):
+        nt = len(gram.KINDS)
+        symbols = gram.KINDS.names + gram.NT_KINDS.names
+        symbol_ids = {name: nt + i for i, name in enumerate(gram.NT_KINDS.names)}
+        symbol_ids.update(gram.KINDS.ids)
+        table = [TABLE_ERROR] * (len(gram.NT_KINDS) * nt)
+        expected = []
+        sync = []
+        for A in gram.NT_KINDS.names:
+            base = gram.NT_KINDS.ids[A] * nt
+            for b, item in gram.ANA_TABLE[A].items():
+                if len(item) == 0:
+                    continue
+                # 有冲突的表项与解释执行时一样取集合中的第一个
+                first = list(item)[0]
+                table[base + gram.KINDS.ids[b]] = TABLE_SYNCH if first == 'synch' else int(first)
+            expected.append(tuple(gram.get_valid_token(A)))
+            # 同步记号：表中不是出错的记号，即能推导 A 的记号和 synch 记号
+            sync.append(frozenset(k for k in range(nt) if table[base + k] != TABLE_ERROR))
+        init = object.__setattr__
+        init(self, 'start', gram.START)
+        init(self, 'symbols', tuple(symbols))
+        init(self, 'kinds', dict(gram.KINDS.ids))
+        init(self, 'start_id', symbol_ids[gram.START])
+        init(self, 'end_id', gram.KINDS.ids['$'])
+        init(self, 'table', tuple(table))
+        # 产生式右部预先反转，按入栈的顺序排列；rhs 为需要入栈的符号编号（不含 '#'），rhs_names 为全部子结点的名字
+        init(self, 'rhs', tuple(tuple(symbol_ids[ch] for ch in beta[::-1] if ch != '#') for _, _, beta in gram.CFG))
+        init(self, 'rhs_names', tuple(tuple(beta[::-1]) for _, _, beta in gram.CFG))
+        # 紧凑模式使用：全部子结点的符号编号，子结点个数，以及其中需要入栈的子结点的序号
+        init(self, 'rhs_ids', tuple(array('i', [symbol_ids[ch] for ch in beta[::-1]]) for _, _, beta in gram.CFG))
+        rhs_sizes = np.array([len(beta) for _, _, beta in gram.CFG], np.int32)
+        rhs_sizes.flags.writeable = False
+        init(self, 'rhs_sizes', rhs_sizes)
+        init(self, 'push_offsets', tuple(tuple(k for k, ch in enumerate(beta[::-1]) if ch != '#')
+                                         for _, _, beta in gram.CFG))
+        init(self, 'expected', tuple(expected))
+        init(self, 'sync', tuple(sync))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledGrammar is read-only')
+
+    def parse(self, tokens, compact=False, trace=None, max_errors=MAX_PARSE_ERRORS):
+        # 分析过程中只创建不会形成循环引用的结点，暂停循环垃圾回收，避免随树增大反复扫描所有结点
+        # compact 为 True 时分析树为 ArrayTree，不为每个结点创建对象
+        # 给出 trace 时使用带跟踪的分析循环，总是得到 Node 树；不跟踪的循环中没有任何跟踪代码
+        result = ParseResult(ArrayTree(self.symbols) if compact and trace is None else Tree(), max_errors)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if trace is not None:
+                self.run_traced(tokens, result, trace)
+            elif compact:
+                self.run_compact(tokens, result)
+            else:
+                self.run(tokens, result)
+        except ParseAborted:
+            result.abort()
+        finally:
+            if enabled:
+                gc.enable()
+        return result
+
+    def run(self, tokens, result):
+        names = self.symbols
+        kinds = self.kinds
+        table = self.table
+        rhs = self.rhs
+        rhs_names = self.rhs_names
+        nt = len(kinds)
+        result.tree.root = Node(self.start, id=1)
+        # 符号编号栈与结点栈同步压入、弹出
+        nodes = [Node('$', id=2), result.tree.root]
+        stack = [self.end_id, self.start_id]
+        node_id = 2
+        tokens = iter(tokens)
+        token = next(tokens, None)
+        kind = -1 if token is None else kinds.get(token[0], -1)
+
+        while stack:
+            if token is None:
+                result.error("illegal end of program", err=False)
+                return
+            top = stack[-1]
+            if top < nt:
+                stack.pop()
+                node_t = nodes.pop()
+                if top == kind:
+                    node_t.symbol = token[1]
+                    node_t.pos = token[2]
+                    token = next(tokens, None)
+                    if token is not None:
+                        kind = kinds.get(token[0], -1)
+                else:
+                    result.error(f'at line {token[2]},  expected {names[top]} but received {token[0]}, move pointer')
+                continue
+            # 未知类别的记号同样按出错处理
+            prod = table[(top - nt) * nt + kind] if kind >= 0 else TABLE_ERROR
+            if prod == TABLE_ERROR:
+                result.error(parse_error_message(token, names[top], list(self.expected[top - nt])))
+                token, kind = self.skip(tokens, top)
+                continue
+            if prod == TABLE_SYNCH:
+                result.error(parse_error_message(token, names[top], list(self.expected[top - nt])))
+                stack.pop()
+                nodes.pop()
+                continue
+            stack.pop()
+            node_t = nodes.pop()
+            children = [Node(name, None, None, node_id + k) for k, name in enumerate(rhs_names[prod], 1)]
+            node_id += len(children)
+            push = rhs[prod]
+            stack.extend(push)
+            if len(push) == len(children):
+                nodes.extend(children)
+            else:
+                nodes.extend([ch_node for ch_node in children if ch_node.data != '#'])
+            children.reverse()
+            node_t.child = children
+
+    def run_traced(self, tokens, result, trace):
+        # 与 run 相同，每一步先把 (栈顶, 向前看, 动作) 记入 trace
+        record = trace.record
+        names = self.symbols
+        kinds = self.kinds
+        table = self.table
+        rhs = self.rhs
+        rhs_names = self.rhs_names
+        nt = len(kinds)
+        result.tree.root = Node(self.start, id=1)
+        nodes = [Node('$', id=2), result.tree.root]
+        stack = [self.end_id, self.start_id]
+        node_id = 2
+        tokens = iter(tokens)
+        token = next(tokens, None)
+        kind = -1 if token is None else kinds.get(token[0], -1)
+
+        while stack:
+            if token is None:
+                result.error("illegal end of program", err=False)
+                return
+            top = stack[-1]
+            if top < nt:
+                stack.pop()
+                node_t = nodes.pop()
+                if top == kind:
+                    record(top, kind, TRACE_SHIFT)
+                    node_t.symbol = token[1]
+                    node_t.pos = token[2]
+                    token = next(tokens, None)
+                    if token is not None:
+                        kind = kinds.get(token[0], -1)
+                else:
+                    record(top, kind, TRACE_MISMATCH)
+                    result.error(f'at line {token[2]},  expected {names[top]} but received {token[0]}, move pointer')
+                continue
+            # 未知类别的记号同样按出错处理
+            prod = table[(top - nt) * nt + kind] if kind >= 0 else TABLE_ERROR
+            record(top, kind, prod)
+            if prod == TABLE_ERROR:
+                result.error(parse_error_message(token, names[top], list(self.expected[top - nt])))
+                token, kind = self.skip(tokens, top)
+                continue
+            if prod == TABLE_SYNCH:
+                result.error(parse_error_message(token, names[top], list(self.expected[top - nt])))
+                stack.pop()
+                nodes.pop()
+                continue
+            stack.pop()
+            node_t = nodes.pop()
+            children = [Node(name, None, None, node_id + k) for k, name in enumerate(rhs_names[prod], 1)]
+            node_id += len(children)
+            stack.extend(rhs[prod])
+            nodes.extend([ch_node for ch_node in children if ch_node.data != '#'])
+            children.reverse()
+            node_t.child = children
+
+    def run_compact(self, tokens, result):
+        # 与 run 相同的分析过程，但不创建结点对象：栈中保存结点下标，推导时只追加子结点的符号编号，
+        # 并记录 (被推导的结点, 产生式) 和 (移进的结点)，分析结束后再一次性求出孩子、兄弟和父结点
+        names = self.symbols
+        kinds = self.kinds
+        table = self.table
+        rhs_ids = self.rhs_ids
+        push_offsets = self.push_offsets
+        nt = len(kinds)
+        tree = result.tree
+        syms = tree.syms
+        attrs, positions = tree.attrs, tree.positions
+        expanded = array('i')
+        productions = array('i')
+        shifted = array('i')
+        # 下标 0 为根，下标 1 为栈底的 '$'，与 Node 的编号一致
+        syms.extend((self.start_id, self.end_id))
+        stack = [1, 0]
+        tokens = iter(tokens)
+        token = next(tokens, None)
+        kind = -1 if token is None else kinds.get(token[0], -1)
+
+        # 错误过多中止时也链接已经建立的部分
+        try:
+            while stack:
+                if token is None:
+                    result.error("illegal end of program", err=False)
+                    break
+                node_t = stack[-1]
+                top = syms[node_t]
+                if top < nt:
+                    stack.pop()
+                    if top == kind:
+                        shifted.append(node_t)
+                        attrs.append(token[1])
+                        positions.append(token[2])
+                        token = next(tokens, None)
+                        if token is not None:
+                            kind = kinds.get(token[0], -1)
+                    else:
+                        result.error(f'at line {token[2]},  expected {names[top]} but received {token[0]}, move pointer')
+                    continue
+                # 未知类别的记号同样按出错处理
+                prod = table[(top - nt) * nt + kind] if kind >= 0 else TABLE_ERROR
+                if prod == TABLE_ERROR:
+                    result.error(parse_error_message(token, names[top], list(self.expected[top - nt])))
+                    token, kind = self.skip(tokens, top)
+                    continue
+                if prod == TABLE_SYNCH:
+                    result.error(parse_error_message(token, names[top], list(self.expected[top - nt])))
+                    stack.pop()
+                    continue
+                stack.pop()
+                base = len(syms)
+                children = rhs_ids[prod]
+                syms += children
+                expanded.append(node_t)
+                productions.append(prod)
+                offsets = push_offsets[prod]
+                if len(offsets) == len(children):
+                    stack.extend(range(base, base + len(children)))
+                else:
+                    stack.extend([base + k for k in offsets])
+        finally:
+            self.link(tree, expanded, productions, shifted)
+
+    def link(self, tree, expanded, productions, shifted):
+        # 每次推导的子结点下标连续，按右部反转的顺序创建：第一个孩子是最后创建的，每个结点的右兄弟是前一个结点
+        n = len(tree.syms)
+        expanded = np.frombuffer(expanded, np.int32) if len(expanded) else np.zeros(0, np.int32)
+        sizes = self.rhs_sizes[np.frombuffer(productions, np.int32)] if len(productions) else np.zeros(0, np.int32)
+        bases = 2 + np.cumsum(sizes) - sizes
+        parent = np.full(n, -1, np.int32)
+        parent[2:] = np.repeat(expanded, sizes)
+        first = np.full(n, -1, np.int32)
+        first[expanded] = bases + sizes - 1
+        nxt = np.arange(-1, n - 1, dtype=np.int32)
+        nxt[:2] = -1
+        nxt[bases] = -1
+        tokens = np.full(n, -1, np.int32)
+        if len(shifted):
+            tokens[np.frombuffer(shifted, np.int32)] = np.arange(len(shifted), dtype=np.int32)
+        tree.parent.frombytes(parent.tobytes())
+        tree.first.frombytes(first.tobytes())
+        tree.next.frombytes(nxt.tobytes())
+        tree.tokens.frombytes(tokens.tobytes())
+        tree.root = NodeView(tree, 0)
+
+    def iter_events(self, tokens, result=None):
+        # 不建树的分析，依次产生事件：
+        # ('enter', 非终结符, 产生式编号)、('shift', 终结符, 记号)、('exit', 非终结符)、('error', 错误信息)
+        # 推导时在子结点下方压入退出标记（符号编号取反），栈的大小只与嵌套深度有关
+        # 给出 result 时错误同时记录在其中，否则只写入日志
+        report = result.error if result is not None else lambda info, err=True: logger.error(info)
+        names = self.symbols
+        kinds = self.kinds
+        table = self.table
+        rhs = self.rhs
+        nt = len(kinds)
+        stack = [self.end_id, self.start_id]
+        tokens = iter(tokens)
+        token = next(tokens, None)
+        kind = -1 if token is None else kinds.get(token[0], -1)
+
+        while stack:
+            top = stack[-1]
+            if top < 0:
+                stack.pop()
+                yield 'exit', names[~top]
+                continue
+            if token is None:
+                info = "illegal end of program"
+                report(info, err=False)
+                yield 'error', info
+                return
+            if top < nt:
+                stack.pop()
+                if top == kind:
+                    yield 'shift', names[top], token
+                    token = next(tokens, None)
+                    if token is not None:
+                        kind = kinds.get(token[0], -1)
+                else:
+                    info = f'at line {token[2]},  expected {names[top]} but received {token[0]}, move pointer'
+                    report(info)
+                    yield 'error', info
+                continue
+            # 未知类别的记号同样按出错处理
+            prod = table[(top - nt) * nt + kind] if kind >= 0 else TABLE_ERROR
+            if prod == TABLE_ERROR or prod == TABLE_SYNCH:
+                info = parse_error_message(token, names[top], list(self.expected[top - nt]))
+                report(info)
+                yield 'error', info
+                if prod == TABLE_ERROR:
+                    token, kind = self.skip(tokens, top)
+                else:
+                    stack.pop()
+                continue
+            stack[-1] = ~top
+            stack.extend(rhs[prod])
+            yield 'enter', names[top], prod
+
+    def parse_events(self, tokens, handler=None, max_errors=MAX_PARSE_ERRORS):
+        # 只检查语法或做单遍统计时使用：不建树，每个事件交给 handler，返回的 ParseResult 中 tree 为 None
+        result = ParseResult(None, max_errors)
+        try:
+            if handler is None:
+                for _ in self.iter_events(tokens, result):
+                    pass
+            else:
+                for event in self.iter_events(tokens, result):
+                    handler(event)
+        except ParseAborted:
+            result.abort()
+        return result
+
+    def skip(self, tokens, top):
+        # 恐慌模式：丢弃记号直到遇到非终结符 top 的同步记号，返回该记号及其类别，记号耗尽时返回 (None, -1)
+        sync = self.sync[top - len(self.kinds)]
+        kinds = self.kinds
+        for token in tokens:
+            kind = kinds.get(token[0], -1)
+            if kind in sync:
+                return token, kind
+        return None, -1
 
 
 if __name__ == '__main__':
@@ -0,0 +1,217 @@
+import os
+import sys
+import random
+import logging
+import tempfile
+
+from grammar import Gram, CompiledGrammar, get_test_tokens
+
+
+# 文法优化：内联只有一个产生式的非终结符（包括单一产生式），把出现在产生式右部首位的非终结符
+# 展开为它的各个产生式（闭包 <C> -> <X><C> 变为 <C> -> α<C> | β<C>），减少推导步数和结点数。
+# 每一步变换后重新构建预测分析表，冲突不能增加；最后在语料和随机句子上检查新旧文法接受的记号串一致。
+# 注意优化后的分析树形状改变，语义分析仍然基于原来的文法
+
+def load(path):
+    gram = Gram(path, table_cache=False)
+    return gram.START, [(A, list(beta)) for _, A, beta in gram.CFG], set(gram.TERMINAL)
+
+
+def format_cfg(prods, terminals):
+    lines = []
+    for A, beta in prods:
+        body = ''.join(f'[{b}]' if b in terminals else f'<{b}>' for b in beta)
+        lines.append(f'<{A}>->{body}')
+    return '\n'.join(lines) + '\n'
+
+
+def build(prods, terminals):
+    # Gram 只能从文件读入文法，写入临时文件后构建
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf8') as fw:
+            fw.write(format_cfg(prods, terminals))
+        return Gram(path, table_cache=False)
+    finally:
+        os.remove(path)
+
+
+def conflict_cells(gram):
+    return {(A, t) for A, idx, terms in gram.conflicts() for t in terms}
+
+
+def substitute(beta, B, gammas, pos):
+    # 把 beta[pos] 处的 B 替换为 B 的每个右部，'#' 只在结果为空时保留
+    res = []
+    for gamma in gammas:
+        body = [b for b in beta[:pos] + gamma + beta[pos + 1:] if b != '#']
+        res.append(body if body else ['#'])
+    return res
+
+
+def inline(prods, B, first_only):
+    # first_only 为 False 时 B 只有一个产生式，替换所有出现；否则只替换出现在右部首位的 B
+    gammas = [beta for A, beta in prods if A == B]
+    res = []
+    for A, beta in prods:
+        if A == B:
+            res.append((A, beta))
+            continue
+        todo = [(A, beta)]
+        done = []
+        while todo:
+            A1, b1 = todo.pop()
+            if first_only:
+                pos = 0 if b1[0] == B else -1
+            else:
+                pos = b1.index(B) if B in b1 else -1
+            if pos < 0:
+                done.append((A1, b1))
+            else:
+                todo.extend((A1, b) for b in reversed(substitute(b1, B, gammas, pos)))
+        res.extend(done)
+    if not any(B in beta for A, beta in res if A != B):
+        res = [(A, beta) for A, beta in res if A != B]
+    return res
+
+
+def optimize(prods, start, terminals, log=print):
+    base = build(prods, terminals)
+    conflicts = conflict_cells(base)
+    frozen = {A for A, t in conflicts}
+    changed = True
+    while changed:
+        changed = False
+        names = list(dict.fromkeys(A for A, beta in prods))
+        for B in names:
+            if B == start or B in frozen:
+                continue
+            own = [beta for A, beta in prods if A == B]
+            if not own or any(B in beta for beta in own):
+                continue
+            users = [(A, beta) for A, beta in prods if A != B and B in beta]
+            if not users or any(A in frozen for A, beta in users):
+                continue
+            first_only = len(own) > 1
+            if first_only and not any(beta[0] == B for A, beta in users):
+                continue
+            new = inline(prods, B, first_only)
+            if conflict_cells(build(new, terminals)) != conflicts:
+                continue
+            log(f'inline <{B}> ({"first position" if first_only else "all uses"}), productions {len(prods)} -> {len(new)}')
+            prods = new
+            changed = True
+    return prods
+
+
+def align_conflicts(old, new):
+    # 冲突的表项取集合中的第一个产生式，而产生式编号是字符串，选中哪一个随哈希种子变化。
+    # 比较语言之前让新文法在每个冲突表项上选择与原文法右部相同的产生式
+    old_body = {idx: beta for idx, A, beta in old.CFG}
+    new_idx = {(A, tuple(beta)): idx for idx, A, beta in new.CFG}
+    for A, t in conflict_cells(old):
+        chosen = old_body[list(old.ANA_TABLE[A][t])[0]]
+        new.ANA_TABLE[A][t] = {new_idx[A, tuple(chosen)]}
+    new.compiled = CompiledGrammar(new)
+
+
+def count_steps(gram, tokens):
+    # 推导和移进的次数，以及分析树的结点数和其中 '#' 结点的个数
+    steps = sum(1 for e in gram.compiled.iter_events(tokens) if e[0] in ('enter', 'shift'))
+    tree = gram.compiled.parse(tokens, compact=True).tree
+    eps = gram.compiled.kinds.get('#', -1)
+    return steps, len(tree), sum(1 for s in tree.syms if s == eps)
+
+
+def accepts(gram, tokens):
+    result = gram.compiled.parse_events(tokens)
+    return not result.err and 'illegal end of program' not in result.errors
+
+
+def random_sentence(gram, rnd, limit=30):
+    # 随机推导出一个句子，深度超过 limit 后总是选择推导高度最小的产生式
+    height = {}
+    changed = True
+    while changed:
+        changed = False
+        for idx, A, beta in gram.CFG:
+            h = 1 + max([height.get(b, 10 ** 9) if b in gram.NON_TERMINAL else 0 for b in beta])
+            if h < height.get(A, 10 ** 9):
+                height[A] = h
+                changed = True
+    prods = {}
+    for idx, A, beta in gram.CFG:
+        prods.setdefault(A, []).append(beta)
+    tokens = []
+    stack = [(gram.START, 0)]
+    while stack:
+        sym, depth = stack.pop()
+        if sym not in gram.NON_TERMINAL:
+            if sym != '#':
+                tokens.append((sym, 'a' if sym == 'id' else 1 if sym == 'digit' else '', (1, 1)))
+            continue
+        if depth > limit:
+            beta = min(prods[sym], key=lambda b: max([height.get(x, 0) for x in b]))
+        else:
+            beta = rnd.choice(prods[sym])
+        stack.extend((b, depth + 1) for b in reversed(beta))
+    tokens.append(('$', '', ''))
+    return tokens
+
+
+def mutate(tokens, rnd):
+    t = list(tokens[:-1])
+    for _ in range(rnd.randint(1, 3)):
+        k = rnd.randrange(len(t)) if t else 0
+        if rnd.random() < 0.5 and t:
+            del t[k]
+        else:
+            t.insert(k, rnd.choice(tokens))
+    return t + [tokens[-1]]
+
+
+def verify(old, new, corpus, samples=500, seed=0):
+    # 两个文法的冲突一致，且在语料、语料的随机变异以及两个文法各自随机生成的句子上接受情况一致
+    align_conflicts(old, new)
+    rnd = random.Random(seed)
+    cases = []
+    for tokens in corpus:
+        cases.append(tokens)
+        cases.extend(mutate(tokens, rnd) for _ in range(20))
+    cases.extend(random_sentence(old, rnd) for _ in range(samples))
+    cases.extend(random_sentence(new, rnd) for _ in range(samples))
+    mismatch = [tokens for tokens in cases if accepts(old, tokens) != accepts(new, tokens)]
+    return len(cases), mismatch
+
+
+def main(cfg_path, out_path, corpus_files):
+    start, prods, terminals = load(cfg_path)
+    new_prods = optimize(prods, start, terminals)
+    with open(out_path, 'w', encoding='utf8') as fw:
+        fw.write(format_cfg(new_prods, terminals))
+    old, new = build(prods, terminals), build(new_prods, terminals)
+    print(f'nonterminals {len(old.NON_TERMINAL)} -> {len(new.NON_TERMINAL)}, productions {len(prods)} -> {len(new_prods)}')
+    print(f'conflicts {sorted(conflict_cells(old))} -> {sorted(conflict_cells(new))}')
+    # 分析出错时会大量写日志，统计和检查期间关闭
+    logging.disable(logging.ERROR)
+    try:
+        corpus = [get_test_tokens(f) for f in corpus_files]
+        total = [0] * 6
+        print('{:40} {:>16} {:>16} {:>16}'.format('file', 'steps', 'nodes', 'epsilon'))
+        for f, tokens in zip(corpus_files, corpus):
+            a, b = count_steps(old, tokens), count_steps(new, tokens)
+            total = [x + y for x, y in zip(total, a + b)]
+            print('{:40} {:>16} {:>16} {:>16}'.format(os.path.basename(f), *(f'{x} -> {y}' for x, y in zip(a, b))))
+        saved = ['{} -> {} ({:.1%})'.format(x, y, 1 - y / x if x else 0) for x, y in zip(total[:3], total[3:])]
+        print('{:40} {:>16} {:>16} {:>16}'.format('total', *saved))
+        n, mismatch = verify(old, new, corpus)
+    finally:
+        logging.disable(logging.NOTSET)
+    print(f'language check: {n} token strings, {len(mismatch)} mismatches')
+    return not mismatch
+
+
+if __name__ == '__main__':
+    # python optimizer.py cfg_resource/cfg_v8.txt cfg_resource/cfg_v8_opt.txt ../instruction/test_case/*.cpp
+    if not main(sys.argv[1], sys.argv[2], sys.argv[3:]):
+        sys.exit(1)
@@ -0,0 +1,173 @@
+import sys
+import inspect
+
+from grammar import Gram, Node, parse_error_message, TABLE_ERROR, TABLE_SYNCH, MAX_PARSE_ERRORS
+
+HEADER = '''# 由 parser_gen.py 根据 {cfg} 生成的递归下降分析器，请勿手动修改
+# parse(tokens, log=None, max_errors={max_errors}) 返回 (根结点, 是否出错, 错误信息列表)，分析树和错误信息与 Gram.parse 相同
+import gc
+
+
+{node}
+
+
+{message}
+
+class IllegalEnd(Exception):
+    pass
+
+
+class ParseAborted(Exception):
+    pass
+
+
+START = {start!r}
+KINDS = {kinds!r}
+
+'''
+
+PARSER = '''
+class Parser:
+    # 每个非终结符对应一个方法，先按向前看记号的类别查表得到产生式，再依次处理右部的各个符号
+    def __init__(self, tokens, log=None, max_errors={max_errors}):
+        self.tokens = iter(tokens)
+        self.log = log
+        self.max_errors = max_errors
+        self.errors = []
+        self.err = False
+        self.node_id = 0
+        self.token = None
+        self.kind = -1
+        self.advance()
+
+    def advance(self):
+        self.token = token = next(self.tokens, None)
+        if token is not None:
+            self.kind = KINDS.get(token[0], -1)
+
+    def error(self, info, err=True):
+        if self.log is not None:
+            self.log(info)
+        self.errors.append(info)
+        if err:
+            self.err = True
+            if len(self.errors) >= self.max_errors:
+                raise ParseAborted
+
+    def skip(self, sync):
+        # 恐慌模式：丢弃记号直到遇到同步记号（sync 为该非终结符的表，其中的记号都不是出错）
+        self.advance()
+        while self.token is not None and self.kind not in sync:
+            self.advance()
+
+    def shift(self, node, kind, name):
+        token = self.token
+        if token is None:
+            raise IllegalEnd
+        if self.kind == kind:
+            node.symbol = token[1]
+            node.pos = token[2]
+            self.advance()
+        else:
+            self.error(f'at line {token[2]},  expected {name} but received {token[0]}, move pointer')
+'''
+
+FOOTER = '''
+
+def parse(tokens, log=None, max_errors={max_errors}):
+    parser = Parser(tokens, log, max_errors)
+    root = Node(START, None, None, 1)
+    end = Node('$', None, None, 2)
+    parser.node_id = 2
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        parser.{start_fn}(root)
+        parser.shift(end, {end_kind}, '$')
+    except IllegalEnd:
+        parser.error("illegal end of program", err=False)
+    except ParseAborted:
+        parser.error(f'too many syntax errors, stop after {{len(parser.errors)}}', err=False)
+    finally:
+        if enabled:
+            gc.enable()
+    return root, parser.err, parser.errors
+'''
+
+
+def generate(cfg_path, out_path=None):
+    # 根据文法生成分析器模块的源码，给出 out_path 时同时写入文件
+    # 有冲突的表项与 Gram 一样取集合中的第一个，生成后即固定下来
+    gram = Gram(cfg_path)
+    compiled = gram.compiled
+    nt = len(gram.KINDS)
+    kinds = dict(compiled.kinds)
+    prods = {}
+    for idx, A, beta in gram.CFG:
+        prods.setdefault(A, []).append((int(idx), beta))
+
+    lines = [HEADER.format(cfg=cfg_path.replace('\\', '/'), node=inspect.getsource(Node).rstrip(),
+                           message=inspect.getsource(parse_error_message), start=gram.START, kinds=kinds,
+                           max_errors=MAX_PARSE_ERRORS)]
+    for i, A in enumerate(gram.NT_KINDS.names):
+        switch = {k: compiled.table[i * nt + k] for k in range(nt) if compiled.table[i * nt + k] != TABLE_ERROR}
+        lines.append(f'S_{i} = {switch!r}\n')
+    lines.append(PARSER.replace('{max_errors}', str(MAX_PARSE_ERRORS)))
+
+    for i, A in enumerate(gram.NT_KINDS.names):
+        message = f'parse_error_message(self.token, {A!r}, {list(compiled.expected[i])!r})'
+        body = [
+            f'    def n_{i}(self, node):',
+            f'        # <{A}>',
+            f'        while True:',
+            f'            if self.token is None:',
+            f'                raise IllegalEnd',
+            f'            prod = S_{i}.get(self.kind, {TABLE_ERROR})',
+        ]
+        for idx, beta in prods[A]:
+            if idx not in compiled.table[i * nt:(i + 1) * nt]:
+                continue
+            body.append(f'            if prod == {idx}:')
+            body.append(f'                # {A} -> {" ".join(beta)}')
+            symbols = [(k, ch) for k, ch in enumerate(beta) if ch != '#']
+            # 子结点按右部反转的顺序编号，与 Gram.parse 一致
+            size = len(beta)
+            children = ', '.join(f'Node({ch!r}, None, None, i + {size - k})' for k, ch in enumerate(beta))
+            body.append(f'                i = self.node_id')
+            body.append(f'                self.node_id = i + {size}')
+            if not symbols:
+                body.append(f'                node.child = [{children}]')
+                body.append(f'                return')
+                continue
+            body.append(f'                node.child = c = [{children}]')
+            for n, (k, ch) in enumerate(symbols):
+                sid = compiled.kinds.get(ch) if ch in gram.TERMINAL else None
+                if sid is not None:
+                    body.append(f'                self.shift(c[{k}], {sid}, {ch!r})')
+                elif n == len(symbols) - 1 and ch == A:
+                    # 右部最后一个符号是自身时改为循环，避免列表类产生式的递归过深
+                    body.append(f'                node = c[{k}]')
+                    body.append(f'                continue')
+                else:
+                    body.append(f'                self.n_{gram.NT_KINDS.ids[ch]}(c[{k}])')
+            if body[-1] != '                continue':
+                body.append(f'                return')
+        body.append(f'            if prod == {TABLE_SYNCH}:')
+        body.append(f'                self.error({message})')
+        body.append(f'                return')
+        body.append(f'            self.error({message})')
+        body.append(f'            self.skip(S_{i})')
+        lines.append('\n' + '\n'.join(body) + '\n')
+
+    lines.append(FOOTER.format(start_fn=f'n_{gram.NT_KINDS.ids[gram.START]}', end_kind=compiled.end_id,
+                               max_errors=MAX_PARSE_ERRORS))
+    source = ''.join(lines)
+    if out_path is not None:
+        with open(out_path, 'w', encoding='utf8') as fw:
+            fw.write(source)
+    return source
+
+
+if __name__ == '__main__':
+    # python parser_gen.py cfg_resource/cfg_v8.txt cfg_v8_parser.py
+    generate(sys.argv[1], sys.argv[2])
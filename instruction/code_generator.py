@@ -4,7 +4,7 @@ import pandas as pd
 import numpy as np
 import self as self
 
-from semantic import Semantic, error_manager
+from semantic import Semantic, Variable, error_manager
 
 sys.path.append('../lexical')
 sys.path.append('../utils')
@@ -12,7 +12,8 @@ sys.path.append('../grammar')
 from lexical import Lex
 from copy import deepcopy
 from log import Log
-from grammar import Gram, get_test_tokens
+from grammar import Gram, Tree, get_test_tokens
+from cache import CompileCache
 from error import *
 from instruction import Instruction, InstructionManager
 
@@ -59,6 +60,75 @@ class Op(Enum):
     get = 'get'
 
 
+def write_mips(text):
+    print(text, end='')
+    with open('result/mips_code.txt', 'w') as fw:
+        fw.write(text)
+
+
+def parse_file(filename, cfg_path, cache=None, key=None, pr=False):
+    # 词法和语法分析，返回语法树，有语法错误时返回 None
+    if cache is not None:
+        data = cache.get(key, 'tree')
+        if data is not None:
+            return Tree.from_binary(data)
+        tokens = cache.get(key, 'tokens')
+    else:
+        tokens = None
+    if tokens is None:
+        lex = Lex()
+        tokens = lex.create_tokens(filename)
+        tokens.append(('$', '', ''))
+        if cache is not None and not lex.err:
+            cache.put(key, 'tokens', tokens)
+    grammar = Gram(cfg_path)
+    grammar.parse(tokens, pr=pr, compact=True)
+    if grammar.err:
+        print('grammar error.')
+        return None
+    if cache is not None:
+        cache.put(key, 'tree', grammar.tree.to_binary())
+    return grammar.tree
+
+
+def compile_file(filename, cfg_path='../grammar/cfg_resource/cfg_v8.txt', cache=None, pr=False):
+    # 完整的编译流程，返回 MIPS 代码，有语法错误时返回 None
+    # 给出 cache 时从最后一个阶段往前查找缓存，只计算缺失的阶段；出错的阶段不写入缓存
+    # 变量偏移是全局计数器，每次编译前清零，保证结果只取决于输入；结点编号由每次分析各自从 1 开始
+    Variable.cur_offset = 0
+    key = cache.key(filename, cfg_path) if cache is not None else None
+    if cache is not None:
+        mips = cache.get(key, 'mips')
+        if mips is not None:
+            write_mips(mips)
+            return mips
+        records = cache.get(key, 'quads')
+    else:
+        records = None
+    ok = True
+    if records is not None:
+        instruction_manager = InstructionManager.from_records(records)
+        instruction_manager.print()
+    else:
+        tree = parse_file(filename, cfg_path, cache, key, pr)
+        if tree is None:
+            return None
+        semantic = Semantic(tree)
+        n_errors = error_manager.count()
+        semantic.run(pr)
+        if error_manager.count() > n_errors:
+            ok = False
+            error_manager.print()
+        instruction_manager = semantic.instruction_manager
+        if cache is not None and ok:
+            cache.put(key, 'quads', instruction_manager.to_records())
+    cg = CodeGenerator(instruction_manager.instructions)
+    mips = cg.mips_translate()
+    if cache is not None and ok:
+        cache.put(key, 'mips', mips)
+    return mips
+
+
 class CodeGenerator:
     def __init__(self, instructions):
         self.instructions = instructions
@@ -86,10 +156,9 @@ class CodeGenerator:
             self.translate(instruction)
         self.mips_instructions.append("\nread:\nli $v0 4\nla $a0 prompt\nsyscall\nli $v0 5\nsyscall\njr $ra\n");
         self.mips_instructions.append("\nwrite:\nli $v0 1\nsyscall\nli $v0 4\nla $a0 end\nsyscall\njr $ra\n");
-        fw = open('result/mips_code.txt', 'w')
-        for inst in self.mips_instructions:
-            print(inst, end='')
-            fw.write(inst)
+        text = ''.join(self.mips_instructions)
+        write_mips(text)
+        return text
 
     def translate(self, inst):
         op = inst.op
@@ -192,7 +261,7 @@ if __name__ == '__main__':
 
     else:
         semantic = Semantic(grammar.tree)
-        semantic.run()
+        semantic.run(pr=True)
 
         semantic.print_variable_table()
         semantic.print_function_table()
@@ -28,6 +28,18 @@ class InstructionManager:
             fw.write(str(ins))
             fw.write('\n')
 
+    def to_records(self):
+        return [(ins.op, ins.num1, ins.num2, ins.res) for ins in self.instructions], self.cur_tmpreg
+
+    @classmethod
+    def from_records(cls, records):
+        instructions, cur_tmpreg = records
+        manager = cls()
+        for op, num1, num2, res in instructions:
+            manager.add_instruction(op, num1, num2, res)
+        manager.cur_tmpreg = cur_tmpreg
+        return manager
+
     def get_temp_reg(self):
         res = "temp" + str(self.cur_tmpreg)
         self.cur_tmpreg += 1
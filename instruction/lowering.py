@@ -0,0 +1,403 @@
+# 把 cfg_v8 的分析树转换为抽象语法树：去掉 '#' 结点、闭包和只有一个孩子的中间结点，
+# 语义分析直接访问结点的字段。分析树可以是 Node 树，也可以是 ArrayTree 的 NodeView
+# 各结点的 id 为对应分析树结点的编号，用于生成与原来相同的标号
+
+
+class AstNode:
+    __slots__ = ()
+
+    def __repr__(self):
+        fields = ', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class Program(AstNode):
+    __slots__ = ('decls',)
+
+    def __init__(self, decls):
+        self.decls = decls
+
+
+class FuncDef(AstNode):
+    # body 为 None 时只有声明；params_pos 为左括号的位置
+    __slots__ = ('type', 'name', 'pos', 'id', 'params', 'params_pos', 'body')
+
+    def __init__(self, type, name, pos, id, params, params_pos, body):
+        self.type = type
+        self.name = name
+        self.pos = pos
+        self.id = id
+        self.params = params
+        self.params_pos = params_pos
+        self.body = body
+
+
+class GlobalDecl(AstNode):
+    # 全局变量：第一个变量 name 之后的变量在 names 中，为 (名字, 位置)
+    __slots__ = ('type', 'name', 'pos', 'names')
+
+    def __init__(self, type, name, pos, names):
+        self.type = type
+        self.name = name
+        self.pos = pos
+        self.names = names
+
+
+class StructDef(AstNode):
+    __slots__ = ('name', 'pos', 'fields')
+
+    def __init__(self, name, pos, fields):
+        self.name = name
+        self.pos = pos
+        self.fields = fields
+
+
+class Field(AstNode):
+    __slots__ = ('type', 'name', 'pos', 'attr')
+
+    def __init__(self, type, name, pos, attr):
+        self.type = type
+        self.name = name
+        self.pos = pos
+        self.attr = attr
+
+
+class StructVar(AstNode):
+    # struct <struct> <name>; 位置为结构体类型名的位置
+    __slots__ = ('struct', 'name', 'pos')
+
+    def __init__(self, struct, name, pos):
+        self.struct = struct
+        self.name = name
+        self.pos = pos
+
+
+class VarDecl(AstNode):
+    # init 为 None 时没有赋初值，init_pos 为 '=' 的位置
+    __slots__ = ('type', 'name', 'pos', 'init', 'init_pos')
+
+    def __init__(self, type, name, pos, init=None, init_pos=None):
+        self.type = type
+        self.name = name
+        self.pos = pos
+        self.init = init
+        self.init_pos = init_pos
+
+
+class Assign(AstNode):
+    # attr 不为 None 时为结构体成员赋值 name.attr = value，op_pos 为 '=' 的位置
+    __slots__ = ('name', 'pos', 'attr', 'value', 'op_pos')
+
+    def __init__(self, name, pos, attr, value, op_pos):
+        self.name = name
+        self.pos = pos
+        self.attr = attr
+        self.value = value
+        self.op_pos = op_pos
+
+
+class Call(AstNode):
+    # args 中只有 Name、Num、Bool；lparen_pos 为左括号的位置
+    __slots__ = ('name', 'pos', 'args', 'lparen_pos')
+
+    def __init__(self, name, pos, args, lparen_pos):
+        self.name = name
+        self.pos = pos
+        self.args = args
+        self.lparen_pos = lparen_pos
+
+
+class If(AstNode):
+    # orelse 为 None 时没有 else 分支（包括 else 语句为 ';' 的情况）
+    __slots__ = ('cond', 'body', 'orelse', 'id')
+
+    def __init__(self, cond, body, orelse, id):
+        self.cond = cond
+        self.body = body
+        self.orelse = orelse
+        self.id = id
+
+
+class While(AstNode):
+    __slots__ = ('cond', 'body', 'id')
+
+    def __init__(self, cond, body, id):
+        self.cond = cond
+        self.body = body
+        self.id = id
+
+
+class Return(AstNode):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Compare(AstNode):
+    __slots__ = ('left', 'op', 'right', 'pos')
+
+    def __init__(self, left, op, right, pos):
+        self.left = left
+        self.op = op
+        self.right = right
+        self.pos = pos
+
+
+class UnaryOp(AstNode):
+    __slots__ = ('op', 'operand', 'pos')
+
+    def __init__(self, op, operand, pos):
+        self.op = op
+        self.operand = operand
+        self.pos = pos
+
+
+class BinOp(AstNode):
+    # 同一优先级的运算链 operand ops[0] operands[0] ops[1] operands[1] ...，与文法中的闭包对应，
+    # 只有一个运算数时不创建 BinOp。positions 为各个运算符的位置
+    __slots__ = ('operand', 'ops', 'operands', 'positions')
+
+    def __init__(self, operand, ops, operands, positions):
+        self.operand = operand
+        self.ops = ops
+        self.operands = operands
+        self.positions = positions
+
+
+class Name(AstNode):
+    __slots__ = ('name', 'pos', 'attr')
+
+    def __init__(self, name, pos, attr=None):
+        self.name = name
+        self.pos = pos
+        self.attr = attr
+
+
+class Num(AstNode):
+    __slots__ = ('value', 'pos')
+
+    def __init__(self, value, pos):
+        self.value = value
+        self.pos = pos
+
+
+class Bool(AstNode):
+    # value 为 'true' 或 'false'，symbol 为记号的属性值
+    __slots__ = ('value', 'symbol')
+
+    def __init__(self, value, symbol):
+        self.value = value
+        self.symbol = symbol
+
+
+def lower(root):
+    # <程序> -> <函数或声明列表>
+    decls = []
+    node = root.child[0]
+    while True:
+        c = node.child
+        if not c[0].is_valid():
+            break
+        decls.append(lower_func_or_dec(c[0]))
+        node = c[1]
+    return Program(decls)
+
+
+def lower_func_or_dec(node):
+    c = node.child
+    if c[0].data != '类型变量':
+        return lower_struct(c[0])
+    tc = c[0].child
+    tp = tc[0].child[0].data
+    name, pos, _ = lower_var(tc[1])
+    impl = c[1]
+    ic = impl.child
+    if ic[0].data == '(':
+        params = lower_param_dec(ic[1])
+        body = ic[3].child
+        return FuncDef(tp, name, pos, impl.id, params, ic[0].pos, lower_block(body[1]) if body[0].data == '{' else None)
+    names = []
+    closure = ic[0].child
+    while closure[0].data == ',':
+        var_name, var_pos, _ = lower_var(closure[1])
+        names.append((var_name, var_pos))
+        closure = closure[2].child
+    return GlobalDecl(tp, name, pos, names)
+
+
+def lower_var(node):
+    # <变量> 为标志符或标准库函数，返回 (名字, 位置, 属性)
+    c = node.child[0]
+    if c.data == '标志符':
+        return lower_symbol(c)
+    t = c.child[0]
+    return t.data, t.pos, None
+
+
+def lower_symbol(node):
+    # <标志符> -> [id]<标志符属性>
+    c = node.child
+    ac = c[1].child
+    attr = ac[1].symbol if ac[0].is_valid() else None
+    return c[0].symbol, c[0].pos, attr or None
+
+
+def lower_param_dec(node):
+    c = node.child
+    if not c[0].is_valid():
+        return []
+    params = [lower_decl(c[0])]
+    closure = c[1].child
+    while closure[0].is_valid():
+        params.append(lower_decl(closure[1]))
+        closure = closure[2].child
+    return params
+
+
+def lower_decl(node):
+    # <声明> -> <类型><变量><赋初值>
+    c = node.child
+    name, pos, _ = lower_var(c[1])
+    init, init_pos = lower_init(c[2])
+    return VarDecl(c[0].child[0].data, name, pos, init, init_pos)
+
+
+def lower_init(node):
+    c = node.child
+    if c[0].data == '=':
+        return lower_exp(c[1].child[0]), c[0].pos
+    return None, None
+
+
+def lower_block(node):
+    # <函数块> -> <函数块闭包>，空语句不保留
+    stmts = []
+    node = node.child[0]
+    while True:
+        c = node.child
+        s = c[0]
+        if not s.is_valid():
+            break
+        kind = s.data
+        sc = s.child
+        if kind == '声明语句':
+            decl = lower_decl(sc[0])
+            stmts.append(decl)
+            closure = sc[1].child
+            while closure[0].is_valid():
+                mc = closure[1].child
+                name, pos, _ = lower_var(mc[0])
+                init, init_pos = lower_init(mc[1])
+                stmts.append(VarDecl(decl.type, name, pos, init, init_pos))
+                closure = closure[2].child
+        elif kind == '赋值函数':
+            name, pos, attr = lower_var(sc[0])
+            ac = sc[1].child
+            if ac[0].data == '=':
+                stmts.append(Assign(name, pos, attr, lower_exp(ac[1].child[0]), ac[0].pos))
+            else:
+                stmts.append(Call(name, pos, lower_args(ac[1]), ac[0].pos))
+        elif kind == 'while循环':
+            stmts.append(While(lower_cond(sc[2]), lower_block(sc[5]), s.id))
+        elif kind == 'if语句':
+            ec = sc[7].child
+            orelse = lower_block(ec[2]) if ec[0].data == 'else' else None
+            stmts.append(If(lower_cond(sc[2]), lower_block(sc[5]), orelse, s.id))
+        elif kind == 'return语句':
+            stmts.append(Return(lower_factor(sc[1])))
+        elif kind == '结构体域声明语句':
+            stmts.append(lower_struct(s))
+        node = c[1]
+    return stmts
+
+
+def lower_struct(node):
+    # <结构体域声明语句> -> [struct]<标志符><结构体实现>
+    c = node.child
+    name, pos, _ = lower_symbol(c[1])
+    ic = c[2].child
+    if ic[0].data != '{':
+        return StructVar(name, ic[0].symbol, pos)
+    fields = []
+    lst = ic[1].child[0].child
+    while lst[0].is_valid():
+        fc = lst[0].child
+        fields.append(Field(fc[0].child[0].data, *lower_symbol(fc[1])))
+        lst = lst[1].child
+    return StructDef(name, pos, fields)
+
+
+def lower_args(node):
+    # <参数列表> -> <参数><参数闭包>
+    c = node.child
+    args = [lower_param(c[0])]
+    closure = c[1].child
+    while closure[0].data == ',':
+        args.append(lower_param(closure[1]))
+        closure = closure[2].child
+    return args
+
+
+def lower_param(node):
+    p = node.child[0]
+    if p.data == '标志符':
+        return Name(*lower_symbol(p))
+    t = p.child[0]
+    if p.data == '数字':
+        return Num(t.symbol, t.pos)
+    return Bool(t.data, t.symbol)
+
+
+def lower_cond(node):
+    # <逻辑表达式> -> [!]<表达式> | <布尔值> | <表达式><逻辑运算符><表达式>
+    c = node.child
+    if c[0].data == '!':
+        return UnaryOp('!', lower_exp(c[1]), c[0].pos)
+    if c[0].data == '布尔值':
+        t = c[0].child[0]
+        return Bool(t.data, t.symbol)
+    op = c[1].child[0]
+    return Compare(lower_exp(c[0]), op.data, lower_exp(c[2]), op.pos)
+
+
+def lower_exp(node):
+    # <表达式> -> <因子><项>，<项> 为加减和按位运算的闭包
+    return lower_chain(node, lower_term)
+
+
+def lower_term(node):
+    # <因子> -> <因式><因式递归>，<因式递归> 为乘除的闭包
+    return lower_chain(node, lower_factor)
+
+
+def lower_chain(node, lower_operand):
+    c = node.child
+    first = lower_operand(c[0])
+    ops, operands, positions = [], [], []
+    closure = c[1].child
+    while closure[0].is_valid():
+        ops.append(closure[0].data)
+        positions.append(closure[0].pos)
+        operands.append(lower_operand(closure[1]))
+        closure = closure[2].child
+    return BinOp(first, ops, operands, positions) if ops else first
+
+
+def lower_factor(node):
+    c = node.child
+    f = c[0]
+    if f.is_terminal():
+        # [(]<表达式>[)]
+        return lower_exp(c[1])
+    if f.data == '数字':
+        t = f.child[0]
+        return Num(t.symbol, t.pos)
+    if f.data == '布尔值':
+        t = f.child[0]
+        return Bool(t.data, t.symbol)
+    name, pos, attr = lower_var(f)
+    call = c[1].child
+    if call[0].is_valid():
+        return Call(name, pos, lower_args(call[1]), call[0].pos)
+    return Name(name, pos, attr)
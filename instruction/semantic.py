@@ -13,6 +13,8 @@ from log import Log
 from grammar import Gram, get_test_tokens
 from error import *
 from instruction import Instruction, InstructionManager
+from lowering import lower, FuncDef, GlobalDecl, StructDef, VarDecl, Assign, Call, If, While, Return, \
+    Compare, UnaryOp, BinOp, Name, Num, Bool
 
 logger = Log("./logs/log.txt")
 pd.set_option('display.max_columns', None)
@@ -104,27 +106,41 @@ class Variable:
 
 
 class VariableManager:
+    # variables 按作用域保存所有定义过的变量（包括已经退出的作用域，打印变量表时使用）；
+    # bindings 为名字到作用域栈的映射，栈顶为当前可见的最近定义，进入作用域时压入，退出时弹出
     def __init__(self):
         self.variables = {}
+        self.bindings = {}
 
     def contains(self, scope, v):
         return scope in self.variables and v in self.variables[scope]
 
     def delete_scope(self, scope):
+        self.exit_scope(scope)
         del self.variables[scope]
 
     def delete_variable(self, scope, v):
         del self.variables[scope][v]
+        stack = self.bindings[v]
+        if stack and stack[-1] == scope:
+            stack.pop()
+
+    def exit_scope(self, scope):
+        # 退出的总是最内层的作用域，其中每个名字的绑定都在各自栈顶
+        for v in self.variables.get(scope, ()):
+            self.bindings[v].pop()
 
     def get_variable(self, scope, v):
         # print('scope', scope, 'v', v)
         return self.variables[scope][v]
 
-    def find_variable(self, scope_list, v):
-        for scope in scope_list[::-1]:
-            if self.contains(scope, v):
-                return scope, self.variables[scope][v]
-        return -1
+    def find_variable(self, v):
+        # 返回 (作用域, 变量)，找不到时返回 -1，与嵌套深度无关
+        stack = self.bindings.get(v)
+        if not stack:
+            return -1
+        scope = stack[-1]
+        return scope, self.variables[scope][v]
 
     def add_variable(self, scope, v, tp, pos=(0, 0), struct_type=None):
         if self.contains(scope, v):
@@ -135,6 +151,7 @@ class VariableManager:
         if scope not in self.variables:
             self.variables[scope] = {}
         self.variables[scope][v] = Variable(tp=TYPE(tp), id=v, pos=pos, struct_type=struct_type)
+        self.bindings.setdefault(v, []).append(scope)
         return None
 
     def set_variable(self, scope, v, v_obj, pos):
@@ -235,11 +252,10 @@ class VariableManager:
     def set_struct_field(self, cur, var_name, var_list, pos):
         self.variables[cur][var_name] = var_list
 
-    def set_struct_attribute(self, cur, scopes, var_name, attribute, v_obj, pos):
-        _, stu = self.find_variable(scopes, var_name)
+    def set_struct_attribute(self, cur, stu, var_name, attribute, v_obj, pos):
         stu_type = stu.struct_type
         # check whether to assign
-        scope, field_list = self.find_variable(scopes, stu_type)
+        scope, field_list = self.find_variable(stu_type)
         for t in field_list:
             if t[1][0] == attribute:
                 if t[0] == v_obj.type:
@@ -310,11 +326,12 @@ class FunctionManager:
 
 
 class ScopeManager:
-    def __init__(self):
+    def __init__(self, variable_manager=None):
         self.scopes = []
         self.cur = 0
         self.gl = 0
         self.max_scope = 0
+        self.variable_manager = variable_manager
 
     def go_scope(self):
         self.max_scope += 1
@@ -322,6 +339,8 @@ class ScopeManager:
         self.scopes.append(self.cur)
 
     def out_scope(self):
+        if self.variable_manager is not None:
+            self.variable_manager.exit_scope(self.cur)
         self.scopes.pop(-1)
         self.cur = self.scopes[-1]
 
@@ -349,450 +368,270 @@ class Semantic:
         self.error_manager = ErrorManager()
         self.variable_manager = VariableManager()
         self.function_manager = FunctionManager()
-        self.scope_manager = ScopeManager()
+        self.scope_manager = ScopeManager(self.variable_manager)
         self.instruction_manager = InstructionManager()
         self.init_function_manager()
 
-    def run(self):
-        self.tree.print()
-        self.proc_program(self.tree.root)
+    def run(self, pr=False):
+        # pr 为 True 时先打印分析树；需要保存时用 Tree.save 或 Tree.save_binary
+        if pr:
+            self.tree.print()
+        self.proc_program(lower(self.tree.root))
         self.instruction_manager.print()
 
-    def proc_program(self, root):
+    def proc_program(self, program):
+        # program 为 lowering.lower 得到的抽象语法树
         self.scope_manager.set_global(0)
         self.scope_manager.go_scope()
-        self.proc_func_or_dec_list(root.child[0])
-
-    def proc_func_or_dec_list(self, node):
-        if node.child[0].is_valid():
-            self.proc_func_or_dec(node.child[0])
-            self.proc_func_or_dec_list(node.child[1])
-
-    def proc_func_or_dec(self, node):
-        if node.child[0].data == '类型变量':
-            tp, var = self.proc_type_var(node.child[0])
-            self.instruction_manager.add_instruction('label', "", "", var)
-
-            self.proc_param_impl_or_var_dec(node.child[1], tp, var)
-
-        else:
-            self.proc_struct_field_stmt(node.child[0])
-
-    def proc_type_var(self, node):
-        tp = self.proc_type(node.child[0])
-        var, pos, attribute = self.proc_var(node.child[1])
-        self.variable_manager.add_variable(self.scope_manager.cur, var, tp, pos)
-        return tp, var
-
-    def proc_type(self, node):
-        return node.child[0].data
-
-    def proc_var(self, node):
-        if node.child[0].data == '标志符':
-            sym, pos, attribute = self.proc_user_symbol(node.child[0])
-        else:
-            attribute = None
-            sym, pos = self.proc_system_symbol(node.child[0])
-        return sym, pos, attribute
-
-    def proc_user_symbol(self, node):
-        var_name, pos = node.child[0].symbol, node.child[0].pos
-        attribute = self.proc_symbol_attribute(node.child[1])
-        if not attribute:
-            return var_name, pos, None
-        return var_name, pos, attribute
-
-    def proc_symbol_attribute(self, node):
-        if node.child[0].is_valid():
-            return node.child[1].symbol
-        return None
+        for decl in program.decls:
+            if type(decl) is FuncDef:
+                self.proc_func_def(decl)
+            elif type(decl) is GlobalDecl:
+                self.proc_global_decl(decl)
+            else:
+                self.proc_struct(decl)
+
+    def proc_func_def(self, func):
+        self.variable_manager.add_variable(self.scope_manager.cur, func.name, func.type, func.pos)
+        self.instruction_manager.add_instruction('label', "", "", func.name)
+        label_func = new_label(f'{func.name}_body', func.id)
+        self.instruction_manager.add_instruction('goto_save', "", "", label_func)
+        # 如果判断为函数，则需要将 变量表 中的变量拿出来，放进函数表中
+        self.variable_manager.delete_variable(self.scope_manager.cur, func.name)
+        self.scope_manager.go_scope()
+        params = [self.proc_var_decl(param) for param in func.params]
+        self.function_manager.add_func(TYPE(func.type), func.name, params, func.params_pos)
 
-    def proc_system_symbol(self, node):
-        # 标准库函数
-        return node.child[0].data, node.child[0].pos
+        label_exit = new_label('exit', func.id)
+        self.instruction_manager.add_instruction('exit', "", "", label_exit)
+        # 要进入代码段了
 
-    def proc_param_impl_or_var_dec(self, node, tp, var):
-        if node.child[0].data == '(':
-            label_func = new_label(f'{var}_body', node.id)
-            self.instruction_manager.add_instruction('goto_save', "", "", label_func)
-            # 如果判断为函数，则需要将 变量表 中的变量拿出来，放进函数表中
-            self.variable_manager.delete_variable(self.scope_manager.cur, var)
-            self.scope_manager.go_scope()
-            # print('cur', self.scope_manager.cur, end='\n')
-            params = self.proc_param_dec(node.child[1])
-            self.function_manager.add_func(TYPE(tp), var, params, node.child[0].pos)
+        self.instruction_manager.add_instruction('label', "", "", label_func)
+        if func.body is not None:
+            self.proc_block(func.body)
+        self.scope_manager.out_scope()
 
-            label_exit = new_label('exit', node.id)
-            self.instruction_manager.add_instruction('exit', "", "", label_exit)
-            # 要进入代码段了
+    def proc_global_decl(self, decl):
+        self.variable_manager.add_variable(self.scope_manager.cur, decl.name, decl.type, decl.pos)
+        self.instruction_manager.add_instruction('label', "", "", decl.name)
+        for var_name, pos in decl.names:
+            self.variable_manager.add_variable(self.scope_manager.cur, var_name, decl.type, pos)
 
-            self.instruction_manager.add_instruction('label', "", "", label_func)
-            self.proc_func_impl(node.child[3])
+    def proc_var_decl(self, decl):
+        self.variable_manager.add_variable(self.scope_manager.cur, decl.name, decl.type, decl.pos)
+        self.proc_init_value(decl)
+        return TYPE(decl.type), decl.name
 
-        else:
-            # print(node.child)
-            self.proc_global_var_closure(node.child[0], tp)
-
-    def proc_global_var_closure(self, node, tp):
-        for child in node.child:
-            if child.data == ';':
-                break
-            elif child.data == '变量':
-                var_name, pos, _ = self.proc_var(child)
-                self.variable_manager.add_variable(self.scope_manager.cur, var_name, tp, pos)
-            elif child.data == '全局变量闭包':
-                self.proc_global_var_closure(child, tp)
-
-    def proc_param_dec(self, node):
-        params = []
-        if node.child[0].is_valid():
-            tp, var = self.proc_dec(node.child[0])
-            params.append((TYPE(tp), var))
-            params = self.proc_dec_closure(node.child[1], params)
-
-        return params
-
-    def proc_dec(self, node):
-        tp = self.proc_type(node.child[0])
-        var_name, pos, attribute = self.proc_var(node.child[1])
-        self.variable_manager.add_variable(self.scope_manager.cur, var_name, tp, pos)
-        self.proc_init_value(node.child[2], var_name)
-        return TYPE(tp), var_name
-
-    def proc_init_value(self, node, v):
-        if node.child[0].data == '=':
-            v_obj = self.proc_rvalue(node.child[1])
+    def proc_init_value(self, decl):
+        if decl.init is not None:
+            v_obj = self.proc_exp(decl.init)
             # 赋值
             if v_obj:
-                self.assign_value(v, v_obj, node.child[0].pos)
-                scope, obj = self.find_near_variable(v)
+                obj = self.assign_value(decl.name, v_obj, decl.init_pos)
                 offset = obj.offset
-                # print('bug:', v_obj.reg)
                 self.instruction_manager.add_instruction('=', v_obj.reg, "", str(offset))
         else:
-            offset = self.variable_manager.get_variable(self.scope_manager.cur, v).offset
+            offset = self.variable_manager.get_variable(self.scope_manager.cur, decl.name).offset
             self.instruction_manager.add_instruction('=', "0", "", str(offset))
-            return
-
-    def proc_rvalue(self, node) -> Variable:
-        return self.proc_exp(node.child[0])
-
-    def proc_exp(self, node):
-        v_obj = self.proc_factor_item(node.child[0])
-        v_item = self.proc_item(node.child[1], v_obj)
-        # print('proc_exp', v_item.reg)
-        return v_item
-
-    def proc_factor_item(self, node):
-        v_obj = self.proc_factor_exp(node.child[0])
-        return self.proc_factor_exp_closure(node.child[1], v_obj)
-
-    def proc_item(self, node, item):
-
-        if node.child[0].is_valid():
-            v_obj = self.proc_factor_item(node.child[1])
-            op = node.child[0].data
-            old_reg = item.reg
-            # print('op', op, 'num1', item, 'num2', v_obj)
-            item = self.variable_manager.op_variable(item, op, v_obj, node.child[0].pos)
-            item = self.proc_item(node.child[2], item)
-            res = self.instruction_manager.get_temp_reg()
-            item.reg = res
-            self.instruction_manager.add_instruction(op, old_reg, v_obj.reg, res)
-            return item
-        return item
 
-    def find_near_variable(self, var_name):
-        return self.variable_manager.find_variable(self.scope_manager.scopes, var_name)
-
-    def proc_factor_exp(self, node):
-        if node.child[0].is_terminal():  # (表达式)
-            return self.proc_exp(node.child[1])
-        elif node.child[0].data == '数字':
-            num = self.proc_digit(node.child[0])
+    def proc_exp(self, exp):
+        tp = type(exp)
+        if tp is BinOp:
+            if exp.ops[0] in ('*', '/'):
+                return self.proc_factor_chain(exp)
+            return self.proc_item_chain(exp)
+        elif tp is Num:
             res = self.instruction_manager.get_temp_reg()
-            # print('res', res)
-            # print('debug num', num)
-            self.instruction_manager.add_instruction('li', num, "", res)
-            return Variable(TYPE.int, num, reg=res)
-        elif node.child[0].data == '布尔值':
-            bool_value = self.proc_bool_value(node.child[0])
-            return Variable(TYPE.bool, bool_value)
-        elif node.child[0].data == '变量':
-            var_name, pos, attr = self.proc_var(node.child[0])
-            if not node.child[1].child[0].is_valid():
-                if not self.var_defined(var_name):
-                    return None
-                if attr is None:
-                    scope, v_obj = self.find_near_variable(var_name)
-                    res = self.instruction_manager.get_temp_reg()
-                    offset = v_obj.offset
-                    self.instruction_manager.add_instruction('lv', str(offset), "", res)
-                    v_obj.reg = res
-                    return v_obj
-                else:
-                    _, v_obj = self.find_near_variable(var_name)
-                    v_attr = v_obj.val[attr]
-                    return v_attr
-            else:
-
-                v_obj_list = self.proc_func_call_param(node.child[1])
-                # TODO 处理函数调用结果计算
-                # print('v_obj_list', v_obj_list)
-                func_name = var_name
-                func = self.function_manager.get(func_name, pos)
-                if not func:
-                    return None
-                # 确定参数类型是否匹配
-                params_list = [e.type for e in v_obj_list]
-
-                if not self.function_manager.params_match(func_name, params_list, pos):
-                    # print(f"{func_name} parameter mis match")
-                    return None
-                return Variable(tp=func.ret_type)
-
-    def proc_factor_exp_closure(self, node, factor_exp):
-        if node.child[0].is_valid():
-            v_obj = self.proc_factor_exp(node.child[1])
-
-            factor_exp = self.variable_manager.op_variable(factor_exp, node.child[0].data, v_obj, node.child[0].pos)
-            factor_exp = self.proc_factor_exp_closure(node.child[2], factor_exp)
-            return factor_exp
-        else:
-            return factor_exp
-
-    def proc_digit(self, node):
-        return node.child[0].symbol
-        pass
-
-    def proc_func_call_param(self, node) -> list:
-        if node.child[0].data == '(':
-            return self.proc_param_list(node.child[1])
-        else:
-            return None
-
-    def proc_param_list(self, node, func_name=None):
-        v_obj = self.proc_param(node.child[0], func_name)
-        v_obj_list = self.proc_param_closure(node.child[1], [v_obj], func_name)
-        return v_obj_list
-
-    def proc_param(self, node, func_name):
-        if node.child[0].data == '标志符':
-            var_name, pos, _ = self.proc_user_symbol(node.child[0])
-            scope, v_obj = self.find_near_variable(var_name)
-            if func_name is None:
+            self.instruction_manager.add_instruction('li', exp.value, "", res)
+            return Variable(TYPE.int, exp.value, reg=res)
+        elif tp is Bool:
+            return Variable(TYPE.bool, exp.value)
+        elif tp is Name:
+            found = self.find_near_variable(exp.name)
+            if found == -1:
+                return None
+            scope, v_obj = found
+            if exp.attr is None:
                 res = self.instruction_manager.get_temp_reg()
                 offset = v_obj.offset
                 self.instruction_manager.add_instruction('lv', str(offset), "", res)
                 v_obj.reg = res
-
-            return v_obj
-        elif node.child[0].data == '数字':
-            num = self.proc_digit(node.child[0])
-            if func_name is None:
-                res = self.instruction_manager.get_temp_reg()
-                # print('error', num)
-                self.instruction_manager.add_instruction('li', num, "", res)
-            return Variable(TYPE.int, num, reg=res)
-
-        elif node.child[0].data == '布尔值':
-            return self.proc_digit(node.child[0])
-
-    def proc_param_closure(self, node, v_obj_list, func_name):
-        if node.child[0].data == ',':
-            val = self.proc_param(node.child[1], func_name)
-            v_obj_list.append(val)
-            return self.proc_param_closure(node.child[2], v_obj_list,func_name)
+                return v_obj
+            return v_obj.val[exp.attr]
         else:
-            return v_obj_list
+            v_obj_list = [self.proc_param(arg) for arg in exp.args]
+            # TODO 处理函数调用结果计算
+            func = self.function_manager.get(exp.name, exp.pos)
+            if not func:
+                return None
+            # 确定参数类型是否匹配
+            params_list = [e.type for e in v_obj_list]
+            if not self.function_manager.params_match(exp.name, params_list, exp.pos):
+                return None
+            return Variable(tp=func.ret_type)
+
+    def proc_factor_chain(self, exp):
+        # 乘除只做类型检查，不生成指令
+        factor_exp = self.proc_exp(exp.operand)
+        for op, operand, pos in zip(exp.ops, exp.operands, exp.positions):
+            v_obj = self.proc_exp(operand)
+            factor_exp = self.variable_manager.op_variable(factor_exp, op, v_obj, pos)
+        return factor_exp
+
+    def proc_item_chain(self, exp):
+        # 先从左到右计算各个运算数并做类型检查，再从最后一个运算符开始依次生成指令，
+        # 左运算数的寄存器取计算前的值，右运算数的寄存器取生成指令时的值
+        item = self.proc_exp(exp.operand)
+        pending = []
+        for op, operand, pos in zip(exp.ops, exp.operands, exp.positions):
+            v_obj = self.proc_exp(operand)
+            pending.append((op, item.reg, v_obj))
+            item = self.variable_manager.op_variable(item, op, v_obj, pos)
+        for op, old_reg, v_obj in reversed(pending):
+            res = self.instruction_manager.get_temp_reg()
+            item.reg = res
+            self.instruction_manager.add_instruction(op, old_reg, v_obj.reg, res)
+        return item
 
-    def proc_func_impl(self, node):
-        if node.child[0].data == ';':
-            self.scope_manager.out_scope()
-            return
-        elif node.child[0].data == '{':
-            self.proc_func_body(node.child[1])
-            self.scope_manager.out_scope()
+    def find_near_variable(self, var_name):
+        return self.variable_manager.find_variable(var_name)
 
-    def proc_func_body(self, node):
-        self.proc_func_body_closure(node.child[0])
-
-    def proc_func_body_closure(self, node):
-
-        if node.child[0].data == '声明语句':
-            self.proc_dec_stmt(node.child[0])
-        elif node.child[0].data == '赋值函数':
-            self.proc_assign_func(node.child[0])
-        elif node.child[0].data == 'while循环':
-            self.proc_while_loop(node.child[0])
-        elif node.child[0].data == 'if语句':
-            self.proc_if_stmt(node.child[0])
-        elif node.child[0].data == '空语句':
-            self.proc_empty_stmt(node.child[0])
-        elif node.child[0].data == 'return语句':
-            self.proc_return_stmt(node.child[0])
-        elif node.child[0].data == '结构体域声明语句':
-            self.proc_struct_field_stmt(node.child[0])
-        elif not node.child[0].is_valid():
-            return
-        self.proc_func_body_closure(node.child[1])
-
-    def proc_dec_stmt(self, node):
-        tp, val = self.proc_dec(node.child[0])
-        self.proc_multi_var_dec_closure(node.child[1], tp)
+    def proc_param(self, arg):
+        if type(arg) is Name:
+            scope, v_obj = self.find_near_variable(arg.name)
+            res = self.instruction_manager.get_temp_reg()
+            offset = v_obj.offset
+            self.instruction_manager.add_instruction('lv', str(offset), "", res)
+            v_obj.reg = res
+            return v_obj
+        elif type(arg) is Num:
+            res = self.instruction_manager.get_temp_reg()
+            self.instruction_manager.add_instruction('li', arg.value, "", res)
+            return Variable(TYPE.int, arg.value, reg=res)
+        return arg.symbol
+
+    def proc_block(self, stmts):
+        for stmt in stmts:
+            tp = type(stmt)
+            if tp is VarDecl:
+                self.proc_var_decl(stmt)
+            elif tp is Assign:
+                self.proc_assign(stmt)
+            elif tp is Call:
+                self.proc_call(stmt)
+            elif tp is While:
+                self.proc_while_loop(stmt)
+            elif tp is If:
+                self.proc_if_stmt(stmt)
+            elif tp is Return:
+                self.proc_return_stmt(stmt)
+            else:
+                self.proc_struct(stmt)
 
     def var_defined(self, val_name):
-        return self.variable_manager.find_variable(self.scope_manager.scopes, val_name) != -1
-
-    def proc_assign_func(self, node):
-        var_name, pos, attribute = self.proc_var(node.child[0])
-        # 判断定义
-        if node.child[1].child[0].data == '=':
-            if not self.var_defined(var_name):
-                err = Error(UndefinedError(var_name), pos)
-                error_manager.add_error(err)
-                return None
-
-        self.proc_assign_or_func_call(node.child[1], var_name, attribute)
+        return self.variable_manager.find_variable(val_name) != -1
 
-    def proc_if_stmt(self, node):
-        label_if = new_label("if", node.id)
-        self.proc_logic_exp(node.child[2]) # 处理表达式，并生成跳转语句
+    def proc_if_stmt(self, stmt):
+        label_if = new_label("if", stmt.id)
+        self.proc_logic_exp(stmt.cond) # 处理表达式，并生成跳转语句
         self.instruction_manager.add_label(label_if) # 回填上一个跳转语句的跳转地址入口为label_if
         self.scope_manager.go_scope() # 更新作用域
-        label_exit = new_label('exit', node.id) # 定义退出的出口label
+        label_exit = new_label('exit', stmt.id) # 定义退出的出口label
         self.instruction_manager.add_instruction('goto', "", "", label_exit) # 生成跳转（隐式的else)
         self.instruction_manager.add_instruction('label', "", "", label_if) # 下面是if成立的内容
-        self.proc_func_body(node.child[5])
+        self.proc_block(stmt.body)
         self.instruction_manager.add_instruction('goto', "", "", label_exit) # 退出if
         self.scope_manager.out_scope() # 退出if的作用域
         self.instruction_manager.add_instruction('label', "", "", label_exit) # 指定exit的入口从这里开始
-        self.proc_else_stmt(node.child[-1]) # 显性的else
-
+        if stmt.orelse is not None: # 显性的else
+            self.scope_manager.go_scope()
+            self.proc_block(stmt.orelse)
+            self.scope_manager.out_scope()
 
-    def proc_while_loop(self, node):
-        label_while = new_label("while", node.id)
-        label_while_block = new_label("while_block", node.id)
-        label_while_exit = new_label("EXIT", node.id)
+    def proc_while_loop(self, stmt):
+        label_while = new_label("while", stmt.id)
+        label_while_block = new_label("while_block", stmt.id)
+        label_while_exit = new_label("EXIT", stmt.id)
         self.instruction_manager.add_instruction("label", "", "", label_while)
-        self.proc_logic_exp(node.child[2])
+        self.proc_logic_exp(stmt.cond)
         self.instruction_manager.add_label(label_while_block)
         self.instruction_manager.add_instruction('goto', "", "", label_while_exit)
-        # print('label', label_while_block)
         self.instruction_manager.add_instruction('label', "", "", label_while_block)
         self.scope_manager.go_scope()
-        self.proc_func_body(node.child[-2])
+        self.proc_block(stmt.body)
         self.instruction_manager.add_instruction('goto', "", "", label_while)
         self.instruction_manager.add_instruction('label', "", "", label_while_exit)
         self.scope_manager.out_scope()
-    def proc_empty_stmt(self, node):
-        pass
 
-    def proc_return_stmt(self, node):
-        v_obj = self.proc_factor_exp(node.child[1])
-        self.instruction_manager.add_instruction('return', "", "", v_obj.reg);
+    def proc_return_stmt(self, stmt):
+        v_obj = self.proc_exp(stmt.value)
+        self.instruction_manager.add_instruction('return', "", "", v_obj.reg)
         return v_obj
 
-    def proc_multi_var_dec_closure(self, node, tp):
-        if not node.child[0].is_valid():
-            return
-        self.proc_multi_var_dec(node.child[1], tp)
-        self.proc_multi_var_dec_closure(node.child[2], tp)
-
-    def proc_multi_var_dec(self, node, tp):
-        var, pos, attr = self.proc_var(node.child[0])
-        self.variable_manager.add_variable(self.scope_manager.cur, var, tp, pos)
-        self.proc_init_value(node.child[1], var)
-
-    def assign_value(self, var_name, v_obj, pos):
-        target_scope, _ = self.variable_manager.find_variable(self.scope_manager.scopes, var_name)
+    def assign_value(self, var_name, v_obj, pos, found=None):
+        # found 为已经查到的 (作用域, 变量)，返回被赋值的变量，调用者不必再查一次
+        target_scope, obj = found or self.variable_manager.find_variable(var_name)
         self.variable_manager.set_variable(target_scope, var_name, v_obj, pos)
+        return obj
 
-    def assign_struct_value(self, var_name, v_obj, attribute, pos):
-        target_scope, _ = self.variable_manager.find_variable(self.scope_manager.scopes, var_name)
+    def assign_struct_value(self, var_name, v_obj, attribute, pos, found=None):
+        target_scope, obj = found or self.variable_manager.find_variable(var_name)
         # self.variable_manager.set_variable(target_scope, var_name, v_obj, pos)
-        self.variable_manager.set_struct_attribute(target_scope, self.scope_manager.scopes, var_name, attribute, v_obj,
-                                                   pos)
+        self.variable_manager.set_struct_attribute(target_scope, obj, var_name, attribute, v_obj, pos)
 
-    def proc_assign_or_func_call(self, node, var_name, attribute):
-        if node.child[0].data == '=':
-            v_obj = self.proc_rvalue(node.child[1])
-            if v_obj:
-                if attribute is None:
-                    self.assign_value(var_name, v_obj, node.child[0].pos)
-                    scope, obj = self.find_near_variable(var_name)
-                    offset = obj.offset
-                    self.instruction_manager.add_instruction('=', v_obj.reg, "", str(offset))
-                else:
-                    # TODO
-                    self.assign_struct_value(var_name, v_obj, attribute, node.child[0].pos)
-        else:
-            # judge
-            # TODO  函数的代码生成
-            func = self.function_manager.get(var_name, node.child[0].pos)
-            if func:
-                # 判断参数类型是否一致
-                func_name = var_name if var_name.startswith('get') else None
-                func_name = None
-                v_obj_list = self.proc_param_list(node.child[1], func_name)
-                if not func:
-                    return None
-                # 确定参数类型是否匹配
-                params_list = [e.type for e in v_obj_list]
-
-                if not self.function_manager.params_match(var_name, params_list, node.child[0].pos):
-                    # print(f"{func_name} parameter mis match")
-                    return None
-
-                # 生成函数调用的中间代码，这里只特殊处理 GET 和 PUT 方法
-                if var_name.startswith('get'):
-                    for param in v_obj_list:
-                        param_name = param.id
-                        scope, obj = self.find_near_variable(param_name)
-                        offset = obj.offset
-                        self.instruction_manager.add_instruction('get', "", "", str(offset))
-                elif var_name == 'put':
-                    # TODO 处理 put
-                    self.instruction_manager.add_instruction('put', "", "", v_obj_list[0].reg)
-
-    def proc_dec_closure(self, node, param_list):
-        if node.child[0].is_valid():
-            param_list.append(self.proc_dec(node.child[1]))
-            return self.proc_dec_closure(node.child[2], param_list)
-        else:
-            return param_list
+    def proc_assign(self, stmt):
+        # 判断定义
+        found = self.find_near_variable(stmt.name)
+        if found == -1:
+            err = Error(UndefinedError(stmt.name), stmt.pos)
+            error_manager.add_error(err)
+            return None
+        v_obj = self.proc_exp(stmt.value)
+        if v_obj:
+            if stmt.attr is None:
+                obj = self.assign_value(stmt.name, v_obj, stmt.op_pos, found)
+                offset = obj.offset
+                self.instruction_manager.add_instruction('=', v_obj.reg, "", str(offset))
+            else:
+                # TODO
+                self.assign_struct_value(stmt.name, v_obj, stmt.attr, stmt.op_pos, found)
+
+    def proc_call(self, stmt):
+        # TODO  函数的代码生成
+        func = self.function_manager.get(stmt.name, stmt.lparen_pos)
+        if func:
+            # 判断参数类型是否一致
+            v_obj_list = [self.proc_param(arg) for arg in stmt.args]
+            # 确定参数类型是否匹配
+            params_list = [e.type for e in v_obj_list]
+
+            if not self.function_manager.params_match(stmt.name, params_list, stmt.lparen_pos):
+                return None
 
-    def proc_logic_exp(self, node):
-        if node.child[0].data == '!':
-            v_obj = self.proc_exp(node.child[1])
-            self.variable_manager.op_variable_single('!', v_obj, node.child[0].data)
-        else:
-            v_obj1 = self.proc_exp(node.child[0])
-            op, pos = self.proc_logic_op(node.child[1])
-            v_obj2 = self.proc_exp(node.child[2])
+            # 生成函数调用的中间代码，这里只特殊处理 GET 和 PUT 方法
+            if stmt.name.startswith('get'):
+                for param in v_obj_list:
+                    param_name = param.id
+                    scope, obj = self.find_near_variable(param_name)
+                    offset = obj.offset
+                    self.instruction_manager.add_instruction('get', "", "", str(offset))
+            elif stmt.name == 'put':
+                # TODO 处理 put
+                self.instruction_manager.add_instruction('put', "", "", v_obj_list[0].reg)
+
+    def proc_logic_exp(self, cond):
+        if type(cond) is UnaryOp:
+            v_obj = self.proc_exp(cond.operand)
+            self.variable_manager.op_variable_single(cond.op, v_obj, cond.pos)
+        elif type(cond) is Compare:
+            v_obj1 = self.proc_exp(cond.left)
+            v_obj2 = self.proc_exp(cond.right)
             res = self.instruction_manager.get_temp_reg()
-            self.instruction_manager.add_instruction(op, v_obj1.reg, v_obj2.reg, res)
-            self.variable_manager.op_variable(v_obj1, op, v_obj2, pos)
-        pass
-
-    def proc_else_stmt(self, node):
-        if node.child[0].data == ';':
-            return
-        elif not node.child[0].is_valid():
-            return
-        elif node.child[0].data == 'else':
-            # 首先先改变上个的跳转地址
-            # label_else = new_label("else", node.id)
-            # self.instruction_manager.add_label(label_else)
-            # self.instruction_manager.add_instruction('label', "", "", label_else)
-            self.scope_manager.go_scope()
-            self.proc_func_body(node.child[2])
-            self.scope_manager.out_scope()
-
-        return
-
-    def proc_logic_op(self, node):
-        return node.child[0].data, node.child[0].pos
+            self.instruction_manager.add_instruction(cond.op, v_obj1.reg, v_obj2.reg, res)
+            self.variable_manager.op_variable(v_obj1, cond.op, v_obj2, cond.pos)
+        else:
+            # 布尔常量
+            self.proc_exp(cond)
 
     def init_function_manager(self):
         # add std library functions
@@ -817,31 +656,17 @@ class Semantic:
         print_line("end")
         print()
 
-    def proc_bool_value(self, node):
-        return node.child[0].data
-
-    def proc_struct_field(self, node, var_name, pos):
-        var_list = []
-        var_list = self.proc_struct_filed_list(node.child[0], var_list)
-        # print(var_list)
-        # 得到了结构体域变proc_struct_field量列表后，加入到变量表中
-        self.variable_manager.add_variable(self.scope_manager.cur, var_name, TYPE.struct, pos)
-        # 对于结构体而言，值是多个变量
-        self.set_struct_field(var_name, var_list, pos)
-
-    def proc_struct_filed_list(self, node, var_list):
-        if node.child[0].is_valid():
-            # print(node)
-            var_type, var_name = self.proc_struct_field_var(node.child[0])
-            var_list.append((TYPE(var_type), var_name))
-            self.proc_struct_filed_list(node.child[1], var_list)
-            return var_list
-        return var_list
-
-    def proc_struct_field_var(self, node):
-        var_type = self.proc_type(node.child[0])
-        var_name = self.proc_user_symbol(node.child[1])
-        return var_type, var_name
+    def proc_struct(self, decl):
+        if type(decl) is StructDef:
+            # 标识定义结构体
+            var_list = [(TYPE(field.type), (field.name, field.pos, field.attr)) for field in decl.fields]
+            # 得到了结构体域变量列表后，加入到变量表中
+            self.variable_manager.add_variable(self.scope_manager.cur, decl.name, TYPE.struct, decl.pos)
+            # 对于结构体而言，值是多个变量
+            self.set_struct_field(decl.name, var_list, decl.pos)
+        else:
+            # TODO 应该在这里实现插入
+            self.variable_manager.add_variable(self.scope_manager.cur, decl.name, TYPE.struct, decl.pos, decl.struct)
 
     def set_struct_field(self, var_name, var_list, pos):
         self.variable_manager.set_struct_field(self.scope_manager.cur, var_name, var_list, pos)
@@ -850,19 +675,6 @@ class Semantic:
         if defined_vars:
             print(f'[WARNING] struct {var_name} variable {defined_vars} have the same name as existing variable')
 
-    def proc_struct_field_stmt(self, node):
-        var_name, pos, attr = self.proc_user_symbol(node.child[1])
-        self.proc_struct_impl(node.child[2], var_name, pos)
-
-    def proc_struct_impl(self, node, var_name, pos):
-        if node.child[0].data == '{':
-            # 标识定义结构体
-            self.proc_struct_field(node.child[1], var_name, pos)
-        else:
-            struct_var_name = node.child[0].symbol
-            # TODO 应该在这里实现插入
-            self.variable_manager.add_variable(self.scope_manager.cur, struct_var_name, TYPE.struct, pos, var_name)
-
 
 def get_easy_tokens():
     tokens = [('id', '1'), ('+', ''), ('id', '2'), ('*', ''), ('id', '3'), ('$', '')]
@@ -913,7 +725,7 @@ if __name__ == '__main__':
 
     else:
         semantic = Semantic(grammar.tree)
-        semantic.run()
+        semantic.run(pr=True)
 
         semantic.print_variable_table()
         semantic.print_function_table()
@@ -1,466 +1,815 @@
-class Lex:
-
-    def __init__(self):
-        self.other_char_list = ['\n', '\t']
-        self.border_char_list = {'+', '-', '*',
-                                 '(', ')', '/', '{', '}', ';', ',', ' ', '\n', '\t', '.'}
-        self.reserved_words_list = ['int', 'bool', 'void', 'return','struct',
-                                    'while', 'if', 'else', 'put', 'get', 'true', 'false']
-
-        self.token_list = []
-        self.symbol_table = {}
-        self.symbol_table_id = {}
-        self.symbol_idx = 0
-        self.state = 0
-        self.attr_dict = {}
-        for e in self.border_char_list:
-            self.attr_dict[e] = ''
-        for e in self.reserved_words_list:
-            self.attr_dict[e] = ''
-        self.attr_dict['<'] = 'LT'
-        self.attr_dict['<='] = 'LE'
-        self.attr_dict['<>'] = 'NE'
-        self.attr_dict['>'] = 'GT'
-        self.attr_dict['>='] = 'GE'
-        self.attr_dict['!'] = 'NON'
-        self.attr_dict['&&'] = 'AND'
-        self.attr_dict['&'] = 'BAND'
-        self.attr_dict['||'] = 'OR'
-        self.attr_dict['|'] = 'BOR'
-        self.attr_dict['=='] = 'EQ'
-        self.attr_dict['='] = ''
-
-    def print_line(self, info):
-        n = len(info)
-        nstar = (50 - n) // 2
-        print('* ' * nstar, info, '* ' * nstar)
-
-    def filter(self, text):
-        p, i = 0, 0
-        result = ''
-        text_len = len(text)
-        while True:
-            if i == text_len:
-                break
-            try:
-                if text[i] == '/' and text[i + 1] == '/':
-                    while text[i] != '\n':
-                        i += 1
-                if text[i] == '/' and text[i + 1] == '*':
-                    i += 2
-                    while text[i] != '*' and text[i + 1] != '/':
-                        i += 1
-                    i += 2
-            except IndexError:
-                print('/ mismatch')
-                exit(0)
-
-            while i < text_len - 1 and text[i] == ' ' and text[i + 1] == ' ':
-                i += 1
-            if text[i] not in self.other_char_list:
-                result += text[i]
-                p += 1
-
-            i += 1
-        return result
-
-    def insert_symbol(self, symbol):
-        if symbol in self.symbol_table.keys():
-            return self.symbol_table[symbol]
-        self.symbol_table[symbol] = self.symbol_idx
-        self.symbol_table_id[self.symbol_idx] = symbol
-        self.symbol_idx += 1
-        return self.symbol_idx - 1
-
-    def insert_token(self, token, attr):
-        if token in ['', ' ', '\n']:
-            return
-        if isinstance(attr, int):
-            self.token_list.append((token, attr, (self.cur_line, self.cur_row)))
-        else:
-            self.token_list.append((token, attr, (self.cur_line, self.cur_row)))
-
-    def print_error(self, info):
-        print(f'{info} at line {self.cur_line}, char at {self.i}')
-
-    def scanner(self, s):
-
-        def case0(tk, c):
-            if c.isalpha():
-                return 1
-            elif c >= '1' and c <= '9':
-                return 2
-            elif c == '<':
-                return 5
-            elif c == '>':
-                return 6
-            elif c == '=':
-                return 7
-            elif c in self.border_char_list:
-                if tk == '!':
-                    self.insert_token('RELATION', tk)
-                    return 0
-                elif tk not in ['', ' ']:
-                    self.insert_token('LOGIC', tk)
-                    return 0
-                else:
-                    return 0
-
-            elif c == '&':
-                return 9
-            elif c == '|':
-                return 11
-            elif c == '0':
-                return 17
-            else:
-                self.print_error("invalid symbol  " + c)
-                return -1
-
-        def case1(tk, c):
-            if c.isalnum():
-                return 1
-            else:
-                if self.in_border(c):
-                    if tk in self.reserved_words_list:
-                        self.insert_token(tk, '')
-                        return 0
-                    else:
-                        idx = self.insert_symbol(tk)
-                        self.insert_token('id', idx)
-                        return 0
-                else:
-                    # UPDATE
-                    # 处理 struct，用.来标识
-                    if c == '.':
-                        self.insert_token(c, '')
-                        return 0
-                    else:
-                        self.print_error("invalid variable name {}".format(c))
-                        # exit(-1)
-                        return -1
-
-        def case2(tk, c):
-            if c.isdigit():
-                return 3
-            elif self.in_border(c):
-                self.insert_token('digit', int(tk))
-                return 0
-            else:
-                self.print_error('invalid number or variable name')
-                return -1
-
-        def case3(tk, c):
-            if c.isdigit():
-                return 4
-            elif self.in_border(c):
-                self.insert_token('digit', int(tk))
-                return 0
-            else:
-                self.print_error("invalid 10 dec base number express")
-                return -1
-
-        def case4(tk, c):
-            if c.isdigit():
-                return 16
-            elif self.in_border(c):
-                self.insert_token('digit', int(tk))
-                return 0
-            else:
-                self.print_error("invalid 10 dec base number express")
-                return -1
-
-        def case16(tk, c):
-            if c not in self.border_char_list:
-                self.print_error('invalid int number(should in range 0-9999)')
-                return -1
-            elif self.in_border(c):
-                self.insert_token('digit', int(tk))
-                return 0
-            else:
-                self.print_error("invalid 10 dec base number express")
-                return -1
-
-        def case5(tk, c):
-            if c in ['=', '>']:
-                return 13
-            elif self.in_border(c):
-                self.insert_token('RELATION', tk)
-                return 0
-            else:
-
-                self.print_error("invalid relation operator")
-                return -1
-
-        def case6(tk, c):
-            if c == '=':
-                return 15
-            elif self.in_border(c):
-                self.insert_token('RELATION', tk)
-                return 0
-            else:
-                self.print_error("invalid relation operator < " + c)
-                return -1
-
-        def case7(tk, c):
-            if c == '=':
-                return 8
-            elif self.in_border(c):
-                self.insert_token('ASSIGN-OP', tk)
-                return 0
-            else:
-                self.print_error("invalid relation operator = " + c)
-                return -1
-
-        def case8(tk, c):
-            if self.in_border(c):
-                self.insert_token('RELATION', tk)
-                return 0
-            else:
-                self.print_error("invalid relation operator == " + c)
-                return -1
-
-        def case9(tk, c):
-            if c == '&':
-                return 10
-            elif self.in_border(c):
-                self.insert_token('LOGIC', tk)
-                return 0
-            else:
-                self.print_error("invalid logic operator & " + c)
-                return -1
-
-        def case10(tk, c):
-            if self.in_border(c):
-
-                self.insert_token('LOGIC', tk)
-                return 0
-            else:
-                self.print_error("invalid logic operator & " + c)
-                return -1
-
-        def case11(tk, c):
-            if c == '|':
-                return 12
-            elif self.in_border(c):
-                self.insert_token('LOGIC', tk)
-                return 0
-            else:
-                self.print_error("invalid logic operator | " + c)
-                return -1
-
-        def case12(tk, c):
-            if self.in_border(c):
-
-                self.insert_token('LOGIC', tk)
-                return 0
-            else:
-                self.print_error("invalid logic operator | " + c)
-                return -1
-
-        def case13(tk, c):
-            if self.in_border(c):
-                self.insert_token('RELATION', tk)
-                return 0
-            else:
-                self.print_error("invalid relation operator < " + c)
-                return -1
-
-        def case15(tk, c):
-            if self.in_border(c):
-                self.insert_token('RELATION', tk)
-                return 0
-            else:
-                self.print_error("invalid relation operator <=" + c)
-                return -1
-
-        def case17(tk, c):
-            if c == 'x':
-                return 19
-            elif '1' <= c <= '7':
-                return 18
-            elif self.in_border(c):
-                self.insert_token('digit', 0)
-                return 0
-            else:
-                self.print_error('invalid number base expression')
-                return -1
-
-        def case18(tk, c):
-            if '1' <= c <= '7':
-                return 18
-            elif self.in_border(c):
-                self.insert_token('digit', int(tk, 8))
-                return 0
-            else:
-                self.print_error('invalid 8 Oct base expression')
-                return -1
-
-        def case19(tk, c):
-            if c.isdigit() or 'a' <= c <= 'f':
-                return 20
-            else:
-                self.print_error('invalid 16 Hex base expression')
-                return -1
-
-        def case20(tk, c):
-            if c.isdigit() or 'a' <= c <= 'f':
-                return 20
-            elif self.in_border(c):
-                self.insert_token('digit', int(tk, 16))
-                return 0
-            else:
-                self.print_error('invalid 16 Hex base expression')
-                return -1
-
-        switch = {
-            0: case0,
-            1: case1,
-            2: case2,
-            3: case3,
-            4: case4,
-            5: case5,
-            6: case6,
-            7: case7,
-            8: case8,
-            9: case9,
-            10: case10,
-            11: case11,
-            12: case12,
-            13: case13,
-            15: case15,
-            16: case16,
-            17: case17,
-            18: case18,
-            19: case19,
-            20: case20
-        }
-
-        self.i = 0
-        self.cur_line = 1
-        self.cur_row = 1
-        slen = len(s)
-
-        tk = ''
-        while s[self.i] in ['\n', '\t', ' ']:
-            self.i += 1
-            self.cur_row += 1
-            if s[self.i] == '\n':
-                self.cur_line += 1
-                self.cur_row = 1
-        while self.i < slen:
-            # process comment
-            while self.i + 1 < slen and s[self.i] == '/' and s[self.i + 1] == '/':
-                # print(self.i, len(s))
-                while self.i < slen and s[self.i] != '\n':
-                    self.i += 1
-                    self.cur_row += 1
-                self.cur_line += 1
-                self.cur_row = 1
-                self.i += 1
-                self.cur_row += 1
-                while self.i < slen and s[self.i] in ['\n', '\t', ' ']:
-                    self.i += 1
-                    self.cur_row += 1
-                    if s[self.i] == '\n':
-                        self.cur_line += 1
-                        self.cur_row = 1
-
-            if self.i >= slen:
-                break
-            c = s[self.i]
-            # print('char', c, 'state', self.state)
-            self.state = switch[self.state](tk, c)
-
-            tk += c
-            if self.state != 0:
-                self.i += 1
-                self.cur_row += 1
-                if self.state == -1:
-                    while s[self.i] not in self.border_char_list:
-                        if s[self.i] == '\n':
-                            self.cur_line += 1
-                            self.cur_row = 1
-                        self.i += 1
-                        self.cur_row += 1
-                    self.i -= 1
-                    self.cur_row -= 1
-                    while s[self.i] in ['\n', '\t', ' ']:
-                        if s[self.i] == '\n':
-                            self.cur_line += 1
-                            self.cur_row = 1
-                        self.i += 1
-                        self.cur_row += 1
-                    self.state = 0
-                    tk = ''
-            else:
-                if c in self.border_char_list:
-                    self.insert_token(c, '')
-                    self.i += 1
-                    self.cur_row += 1
-                tk = ''
-                while self.i < slen and s[self.i] in ['\n', '\t', ' ']:
-                    if s[self.i] == '\n':
-                        self.cur_line += 1
-                        self.cur_row = 1
-                    self.i += 1
-                    self.cur_row += 1
-
-    def run(self, filename, preprocess=False):
-        file = open(filename, encoding='utf8')
-        text = file.read()
-        self.print_line('origin data')
-
-        print(text)
-        if preprocess:
-            text = self.filter(text)
-            self.print_line('pre processed data')
-            print(text)
-
-        print()
-        self.scanner(text)
-        self.print_line('lexical result')
-        for elem in self.token_list:
-            print(elem)
-
-    def create_tokens(self, filename):
-        file = open(filename, encoding='utf8')
-        text = file.read()
-        self.scanner(text)
-        # create new token_list
-        tokens = []
-        for k, v, pos in self.token_list:
-            if v == '':
-                tokens.append((k, '', pos))
-            elif k == 'id':
-                tokens.append((k, self.symbol_table_id[v], pos))
-            elif k == 'digit':
-                tokens.append((k, v, pos))
-            else:
-                tokens.append((v, '', pos))
-
-        return tokens
-
-    def print_static_data(self):
-        self.print_line('statictics info')
-        print('total code lines', self.cur_line)
-        print('total characters counts', self.i)
-        from collections import Counter
-        counter = Counter(self.token_list)
-        for elem, cnt in counter.items():
-            if elem[0] == 'id':
-                print(f'({self.symbol_table_id[elem[1]]}, {cnt})')
-            elif elem[1] != '':
-                print(f'({elem[0]}.{elem[1]}, {cnt})')
-            else:
-                print(f'({elem[0]}, {cnt})')
-
-    def in_border(self, c):
-        return c in self.border_char_list or c.isalnum() or c in ['=', '<', '>', '!', '&', '|']
-
-
-if __name__ == '__main__':
-    # file = open("./full_test.cpp", encoding='utssf8')
-    filepath = 'struct_test.cpp'
-    lex = Lex()
-    lex.run(filepath, preprocess=False)
-    # lex.print_static_data()
+import mmap
+import os
+import re
+from bisect import bisect_left, bisect_right
+
+from source_map import LineIndex, SourceMap
+from token_stream import TokenStream
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 字符类别，每个字符在首次出现时分类一次并缓存
+C_OTHER = 0
+C_BORDER = 1
+C_ALPHA = 2  # 除 a-f、x 以外的字母
+C_HEX = 3  # a-f
+C_X = 4
+C_ZERO = 5
+C_OCT = 6  # 1-7
+C_DEC = 7  # 8-9
+C_UDIGIT = 8  # 非 ASCII 数字
+C_UALNUM = 9  # 其余 isalnum 字符
+C_LT = 10
+C_GT = 11
+C_EQ = 12
+C_AMP = 13
+C_BAR = 14
+C_BANG = 15
+N_CLASSES = 16
+
+SPECIAL_CHAR_CLASSES = {'<': C_LT, '>': C_GT, '=': C_EQ, '&': C_AMP, '|': C_BAR, '!': C_BANG,
+                        'x': C_X, '0': C_ZERO, '8': C_DEC, '9': C_DEC}
+for _c in 'abcdef':
+    SPECIAL_CHAR_CLASSES[_c] = C_HEX
+for _c in '1234567':
+    SPECIAL_CHAR_CLASSES[_c] = C_OCT
+
+WHITESPACE = frozenset(['\n', '\t', ' '])
+# 产生后状态机一定回到状态 0 的记号，relex 从这些记号之后续扫
+RESTART_TOKENS = frozenset('+-*()/{};,.')
+DIGIT_CLASSES = (C_ZERO, C_OCT, C_DEC, C_UDIGIT)
+ALNUM_CLASSES = (C_ALPHA, C_HEX, C_X) + DIGIT_CLASSES + (C_UALNUM,)
+# in_border 为真的字符类别
+BORDER_CLASSES = (C_BORDER, C_LT, C_GT, C_EQ, C_AMP, C_BAR, C_BANG) + ALNUM_CLASSES
+
+# 接收单词时的动作
+ACT_NONE = 0
+ACT_WORD = 1
+ACT_DEC = 2
+ACT_ZERO = 3
+ACT_OCT = 4
+ACT_HEX = 5
+ACT_RELATION = 6
+ACT_ASSIGN = 7
+ACT_LOGIC = 8
+ACTION_TOKENS = {ACT_RELATION: 'RELATION', ACT_ASSIGN: 'ASSIGN-OP', ACT_LOGIC: 'LOGIC'}
+
+# 状态机: state -> (转移, 接收动作, 接收的字符类别, 错误信息)
+DFA_SPEC = {
+    0: ({C_ALPHA: 1, C_HEX: 1, C_X: 1, C_OCT: 2, C_DEC: 2, C_LT: 5, C_GT: 6, C_EQ: 7,
+         C_AMP: 9, C_BAR: 11, C_ZERO: 17}, ACT_NONE, (C_BORDER,), 'invalid symbol  {}'),
+    1: (dict.fromkeys(ALNUM_CLASSES, 1), ACT_WORD, BORDER_CLASSES, 'invalid variable name {}'),
+    2: (dict.fromkeys(DIGIT_CLASSES, 3), ACT_DEC, BORDER_CLASSES, 'invalid number or variable name'),
+    3: (dict.fromkeys(DIGIT_CLASSES, 4), ACT_DEC, BORDER_CLASSES, 'invalid 10 dec base number express'),
+    4: (dict.fromkeys(DIGIT_CLASSES, 16), ACT_DEC, BORDER_CLASSES, 'invalid 10 dec base number express'),
+    5: ({C_EQ: 13, C_GT: 13}, ACT_RELATION, BORDER_CLASSES, 'invalid relation operator'),
+    6: ({C_EQ: 15}, ACT_RELATION, BORDER_CLASSES, 'invalid relation operator < {}'),
+    7: ({C_EQ: 8}, ACT_ASSIGN, BORDER_CLASSES, 'invalid relation operator = {}'),
+    8: ({}, ACT_RELATION, BORDER_CLASSES, 'invalid relation operator == {}'),
+    9: ({C_AMP: 10}, ACT_LOGIC, BORDER_CLASSES, 'invalid logic operator & {}'),
+    10: ({}, ACT_LOGIC, BORDER_CLASSES, 'invalid logic operator & {}'),
+    11: ({C_BAR: 12}, ACT_LOGIC, BORDER_CLASSES, 'invalid logic operator | {}'),
+    12: ({}, ACT_LOGIC, BORDER_CLASSES, 'invalid logic operator | {}'),
+    13: ({}, ACT_RELATION, BORDER_CLASSES, 'invalid relation operator < {}'),
+    15: ({}, ACT_RELATION, BORDER_CLASSES, 'invalid relation operator <={}'),
+    16: ({}, ACT_DEC, (C_BORDER,), 'invalid int number(should in range 0-9999)'),
+    17: ({C_X: 19, C_OCT: 18}, ACT_ZERO, BORDER_CLASSES, 'invalid number base expression'),
+    18: ({C_OCT: 18}, ACT_OCT, BORDER_CLASSES, 'invalid 8 Oct base expression'),
+    19: (dict.fromkeys(DIGIT_CLASSES + (C_HEX,), 20), ACT_NONE, (), 'invalid 16 Hex base expression'),
+    20: (dict.fromkeys(DIGIT_CLASSES + (C_HEX,), 20), ACT_HEX, BORDER_CLASSES, 'invalid 16 Hex base expression'),
+}
+
+
+def build_dfa_table():
+    # 稠密的 (state x 字符类别) 表，表项为 (下一状态, 动作, 错误信息)
+    table = [None] * (max(DFA_SPEC) + 1)
+    for state, (shift, action, accept, error) in DFA_SPEC.items():
+        row = []
+        for cls in range(N_CLASSES):
+            if cls in shift:
+                row.append((shift[cls], ACT_NONE, None))
+            elif cls in accept:
+                row.append((0, action, None))
+            else:
+                row.append((-1, ACT_NONE, error))
+        table[state] = tuple(row)
+    return table
+
+
+DFA_TABLE = build_dfa_table()
+
+# 正则后端：所有单词类别合并为一个正则，交给 re 的 C 实现逐个匹配
+# 只覆盖 ASCII 的合法输入，其余字符落入 other 分组，由状态机重新扫描以得到相同的错误信息
+MASTER_PATTERN = r"""
+    (?P<comment>//[^\n]*)
+  | (?P<ws>[ \t\n]+)
+  | (?P<hex>0x[0-9a-f]+)
+  | (?P<oct>0(?!x)[1-7]*)
+  | (?P<dec>[1-9][0-9]{0,2}(?![0-9])|[1-9][0-9]{3}(?=[-+*()/{};,.\ \t\n]|\Z))
+  | (?P<word>[A-Za-z][A-Za-z0-9]*)
+  | (?P<relation><[=>]?|>=?|==)
+  | (?P<assign>=)
+  | (?P<logic>&&?|\|\|?)
+  | (?P<border>[-+*()/{};,.])
+  | (?P<other>.)
+"""
+# 预处理时压缩的空白和注释，open 分组表示未闭合的 /*
+SKIP_RE = re.compile(r"(?:[ \t\r\n]|//[^\n]*|/\*.*?\*/)+|(?P<open>/\*)", re.DOTALL)
+
+MASTER_RE = re.compile(MASTER_PATTERN, re.VERBOSE | re.DOTALL)
+MASTER_RE_BYTES = re.compile(MASTER_PATTERN.encode('ascii'), re.VERBOSE | re.DOTALL)
+
+# numpy 后端：每个字节先查表得到游程类别，相同类别的连续字节（边界符除外）构成一个游程
+R_WS = 0
+R_WORD = 1  # 字母和数字
+R_OP = 2  # < > = & |
+R_BORDER = 3
+R_OTHER = 4
+RUN_CLASSES = [R_OTHER] * 256
+for _c in ' \t\n':
+    RUN_CLASSES[ord(_c)] = R_WS
+for _c in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789':
+    RUN_CLASSES[ord(_c)] = R_WORD
+for _c in '<>=&|':
+    RUN_CLASSES[ord(_c)] = R_OP
+for _c in '+-*()/{};,.':
+    RUN_CLASSES[ord(_c)] = R_BORDER
+RUN_TABLE = np.array(RUN_CLASSES, dtype=np.uint8) if np is not None else None
+# 运算符游程按最长匹配切分，数字游程只接受合法的常量，其余交给正则后端
+OP_RE = re.compile(r'<[=>]?|>=?|==?|&&?|\|\|?')
+NUMBER_RE = re.compile(r'0x[0-9a-f]+|0[1-7]*|[1-9][0-9]{0,3}')
+
+
+class Lex:
+
+    def __init__(self, backend='dfa'):
+        if backend not in ('dfa', 'regex', 'numpy'):
+            raise ValueError(f'unknown lexer backend {backend}')
+        if backend == 'numpy' and np is None:
+            raise ValueError('numpy lexer backend requires numpy')
+        self.backend = backend
+        self.fallback = False
+        self.err = False
+        self.source_map = None
+        self.other_char_list = ['\n', '\t']
+        self.border_char_list = {'+', '-', '*',
+                                 '(', ')', '/', '{', '}', ';', ',', ' ', '\n', '\t', '.'}
+        self.reserved_words_list = ['int', 'bool', 'void', 'return','struct',
+                                    'while', 'if', 'else', 'put', 'get', 'true', 'false']
+
+        # 记号为 (类别, 属性, 偏移)，偏移经 line_index 换算为行列号
+        self.token_list = []
+        self.line_index = LineIndex()
+        self.symbol_table = {}
+        self.symbol_table_id = {}
+        self.symbol_idx = 0
+        self.state = 0
+        self.attr_dict = {}
+        for e in self.border_char_list:
+            self.attr_dict[e] = ''
+        for e in self.reserved_words_list:
+            self.attr_dict[e] = ''
+        self.attr_dict['<'] = 'LT'
+        self.attr_dict['<='] = 'LE'
+        self.attr_dict['<>'] = 'NE'
+        self.attr_dict['>'] = 'GT'
+        self.attr_dict['>='] = 'GE'
+        self.attr_dict['!'] = 'NON'
+        self.attr_dict['&&'] = 'AND'
+        self.attr_dict['&'] = 'BAND'
+        self.attr_dict['||'] = 'OR'
+        self.attr_dict['|'] = 'BOR'
+        self.attr_dict['=='] = 'EQ'
+        self.attr_dict['='] = ''
+        self.char_classes = {}
+        for i in range(128):
+            self.char_class(chr(i))
+
+    def print_line(self, info):
+        n = len(info)
+        nstar = (50 - n) // 2
+        print('* ' * nstar, info, '* ' * nstar)
+
+    def filter(self, text):
+        return self.preprocess(text)[0]
+
+    def preprocess(self, text):
+        # 一次线性扫描：删除 // 和 /* */ 注释，连续的空白和注释压缩为一个空格，
+        # 同时记录保留片段在原文中的位置，得到的文本只有一行
+        source_map = SourceMap(text)
+        pieces = []
+        out_len = 0
+        last = 0
+        text_len = len(text)
+        for m in SKIP_RE.finditer(text):
+            if m.lastgroup == 'open':
+                print('/ mismatch')
+                exit(0)
+            start = m.start()
+            if start > last:
+                source_map.add(out_len, last)
+                pieces.append(text[last:start])
+                out_len += start - last
+                if m.end() < text_len:
+                    pieces.append(' ')
+                    out_len += 1
+            last = m.end()
+        if last < text_len:
+            source_map.add(out_len, last)
+            pieces.append(text[last:])
+        return ''.join(pieces), source_map
+
+    def restore_positions(self):
+        # 把记号在预处理后文本中的偏移换回原文中的偏移
+        to_source = self.source_map.to_source
+        self.token_list = [(k, v, to_source(offset)) for k, v, offset in self.token_list]
+        self.line_index = self.source_map.lines
+        self.source_map = None
+
+    def position(self, offset):
+        # 按需把偏移换算为 (行, 列)
+        if self.source_map is not None:
+            return self.source_map.position(offset)
+        return self.line_index.position(offset)
+
+    def insert_symbol(self, symbol):
+        if symbol in self.symbol_table.keys():
+            return self.symbol_table[symbol]
+        self.symbol_table[symbol] = self.symbol_idx
+        self.symbol_table_id[self.symbol_idx] = symbol
+        self.symbol_idx += 1
+        return self.symbol_idx - 1
+
+    def insert_token(self, token, attr):
+        if token in ['', ' ', '\n']:
+            return
+        self.token_list.append((token, attr, self.i))
+
+    def print_error(self, info):
+        self.err = True
+        line, _ = self.position(self.i)
+        if self.source_map is not None:
+            print(f'{info} at line {line}, char at {self.source_map.to_source(self.i)}')
+        else:
+            print(f'{info} at line {line}, char at {self.i}')
+
+    def char_class(self, c):
+        cls = self.char_classes.get(c)
+        if cls is None:
+            if c in self.border_char_list:
+                cls = C_BORDER
+            elif c in SPECIAL_CHAR_CLASSES:
+                cls = SPECIAL_CHAR_CLASSES[c]
+            elif c.isalpha():
+                cls = C_ALPHA
+            elif c.isdigit():
+                cls = C_UDIGIT
+            elif c.isalnum():
+                cls = C_UALNUM
+            else:
+                cls = C_OTHER
+            self.char_classes[c] = cls
+        return cls
+
+    def scanner(self, s, offset=0):
+        # offset 为 s 在整个源文件中的起始偏移
+        # 记号只记录单词首字符（边界符为其自身）的偏移，行列号由 position 按需换算
+        table = DFA_TABLE
+        classes = self.char_classes
+        char_class = self.char_class
+        border = self.border_char_list
+        reserved = self.reserved_words_list
+        emit = self.token_list.append
+
+        i = 0
+        slen = len(s)
+        state = self.state
+        tk = ''
+        start = 0
+        while i < slen and s[i] in WHITESPACE:
+            i += 1
+        while i < slen:
+            # process comment
+            while i + 1 < slen and s[i] == '/' and s[i + 1] == '/':
+                nl = s.find('\n', i + 2)
+                i = slen if nl == -1 else nl + 1
+                while i < slen and s[i] in WHITESPACE:
+                    i += 1
+
+            if i >= slen:
+                break
+            c = s[i]
+            cls = classes.get(c)
+            if cls is None:
+                cls = char_class(c)
+            last_state = state
+            state, action, msg = table[state][cls]
+
+            if action:
+                pos = offset + start
+                if action == ACT_WORD:
+                    if tk in reserved:
+                        emit((tk, '', pos))
+                    else:
+                        emit(('id', self.insert_symbol(tk), pos))
+                elif action == ACT_DEC:
+                    emit(('digit', int(tk), pos))
+                elif action == ACT_ZERO:
+                    emit(('digit', 0, pos))
+                elif action == ACT_OCT:
+                    emit(('digit', int(tk, 8), pos))
+                elif action == ACT_HEX:
+                    emit(('digit', int(tk, 16), pos))
+                else:
+                    emit((ACTION_TOKENS[action], tk, pos))
+            elif msg is not None:
+                self.i = offset + i
+                self.print_error(msg.format(c))
+
+            if last_state == 0:
+                start = i
+            tk += c
+            if state != 0:
+                i += 1
+                if state == -1:
+                    err_pos = i - 1
+                    while i < slen and s[i] not in border:
+                        i += 1
+                    # 错误字符紧邻边界符时不回退，避免在同一位置反复报错
+                    if not (last_state == 0 and i - 1 == err_pos):
+                        i -= 1
+                    while i < slen and s[i] in WHITESPACE:
+                        i += 1
+                    state = 0
+                    tk = ''
+            else:
+                if c in border:
+                    if c != ' ' and c != '\n':
+                        emit((c, '', offset + i))
+                    i += 1
+                tk = ''
+                while i < slen and s[i] in WHITESPACE:
+                    i += 1
+
+        self.i = offset + slen
+        self.state = state
+
+    def scan(self, s, offset=0):
+        # 字节输入（如 mmap）只能由正则后端直接扫描
+        # 预处理时行列号由 source_map 给出
+        if self.source_map is not None:
+            pass
+        elif offset == 0:
+            self.line_index = LineIndex(s)
+        else:
+            self.line_index.extend(s, offset)
+        self.scan_backend(s, offset)
+
+    def scan_backend(self, s, offset=0):
+        if self.backend == 'numpy':
+            self.numpy_scanner(s, offset)
+        elif self.backend == 'regex' or not isinstance(s, str):
+            self.regex_scanner(s, offset)
+        else:
+            self.scanner(s, offset)
+
+    def regex_scanner(self, s, offset=0):
+        # 输出与 scanner 一致，s 可以是 str，也可以是 bytes / mmap，后者只在产生记号时解码对应的片段
+        # 字节输入中非 ASCII 字符只会出现在注释里，而注释一直延续到行尾，
+        # 所以记号的字节偏移换算出的行列号与字符偏移相同
+        binary = not isinstance(s, str)
+        if binary:
+            pattern, tab = MASTER_RE_BYTES, b'\t'
+        else:
+            pattern, tab = MASTER_RE, '\t'
+        tokens = []
+        emit = tokens.append
+        reserved = self.reserved_words_list
+        symbol_idx = self.symbol_idx
+        slen = len(s)
+        # 注释中多字节字符占用的额外字节数，用于把字节数换算为字符数
+        extra = 0
+        pending = None
+        for m in pattern.finditer(s):
+            kind = m.lastgroup
+            start = m.start()
+            if pending is not None:
+                if kind == 'comment' or kind == 'other':
+                    break
+                kind_name, attr, pos = pending
+                if kind_name is None:
+                    # 标识符在被接收时才插入符号表
+                    if attr in reserved:
+                        emit((attr, '', pos))
+                    else:
+                        emit(('id', self.insert_symbol(attr), pos))
+                else:
+                    emit(pending)
+                pending = None
+                if kind == 'ws' and m.group()[:1] == tab:
+                    emit(('\t', '', offset + start))
+            elif kind == 'other':
+                break
+
+            if kind == 'ws':
+                continue
+            if kind == 'comment':
+                if binary:
+                    text = m.group()
+                    if b'\r' in text:
+                        # 文本模式下 \r 会被转换为换行
+                        break
+                    if not text.isascii():
+                        extra += len(text) - len(text.decode('utf8', 'replace'))
+                continue
+            text = m.group()
+            if binary:
+                text = text.decode('ascii')
+            pos = offset + start
+            if kind == 'word':
+                pending = (None, text, pos)
+            elif kind == 'dec':
+                pending = ('digit', int(text), pos)
+            elif kind == 'oct':
+                pending = ('digit', int(text, 8) if len(text) > 1 else 0, pos)
+            elif kind == 'hex':
+                pending = ('digit', int(text, 16), pos)
+            elif kind == 'relation':
+                pending = ('RELATION', text, pos)
+            elif kind == 'assign':
+                pending = ('ASSIGN-OP', '=', pos)
+            elif kind == 'logic':
+                pending = ('LOGIC', text, pos)
+            else:
+                emit((text, '', pos))
+        else:
+            self.token_list.extend(tokens)
+            self.i = offset + slen - extra
+            return
+
+        # 遇到非法字符，撤销插入的符号，回退到状态机
+        for idx in range(symbol_idx, self.symbol_idx):
+            del self.symbol_table[self.symbol_table_id.pop(idx)]
+        self.symbol_idx = symbol_idx
+        self.fallback = True
+        if binary:
+            # 非 ASCII 字符出现在注释以外，只能解码后交给状态机，换行的处理与文本模式的 open 一致
+            s = s[:].decode('utf8').replace('\r\n', '\n').replace('\r', '\n')
+            self.line_index = LineIndex(s)
+        self.scanner(s, offset)
+
+    def numpy_scanner(self, s, offset=0):
+        # 向量化的预处理：整段字节一次查表得到游程类别，用 np.diff / np.flatnonzero 找出游程边界，
+        # Python 循环只访问游程（即单词），不再逐个字符
+        # 非 ASCII、非法字符、不合法的数字以及紧跟在单词后的注释交给正则后端，由它得到一致的错误信息
+        if isinstance(s, str):
+            if not s.isascii():
+                return self.regex_scanner(s, offset)
+            data = s.encode('ascii')
+        else:
+            data = s
+        slen = len(data)
+        if slen == 0:
+            self.i = offset
+            return
+        buf = np.frombuffer(data, np.uint8)
+        extra = 0
+        if data is s:
+            if (buf == 13).any():
+                # 文本模式下 \r 会被转换为换行
+                del buf
+                return self.regex_scanner(s, offset)
+            # 注释中多字节字符的后续字节数，用于把字节数换算为字符数
+            extra = int(np.count_nonzero((buf & 0xC0) == 0x80))
+        cls = RUN_TABLE[buf]
+        # 注释视为空白，注释中可以出现任意字符
+        comments = np.flatnonzero((buf[:-1] == 47) & (buf[1:] == 47)).tolist()
+        del buf
+        if comments:
+            nl = b'\n' if not isinstance(s, str) else '\n'
+            end = -1
+            for start in comments:
+                if start < end:
+                    continue
+                if start and cls[start - 1] != R_WS and cls[start - 1] != R_BORDER:
+                    # 注释紧跟在单词后，状态机会把注释两侧拼成一个单词
+                    return self.regex_scanner(s, offset)
+                end = s.find(nl, start + 2)
+                if end == -1:
+                    end = slen
+                cls[start:end] = R_WS
+        if (cls == R_OTHER).any():
+            return self.regex_scanner(s, offset)
+
+        change = np.empty(slen, dtype=bool)
+        change[0] = True
+        np.not_equal(np.diff(cls), 0, out=change[1:])
+        change |= cls == R_BORDER
+        bounds = np.flatnonzero(change)
+        run_cls = cls[bounds]
+        keep = run_cls != R_WS
+        starts = bounds[keep].tolist()
+        ends = np.append(bounds[1:], slen)[keep].tolist()
+        kinds = run_cls[keep].tolist()
+        del cls
+
+        emit = self.token_list.append
+        mark = len(self.token_list)
+        symbol_idx = self.symbol_idx
+        symbol_table = self.symbol_table
+        insert_symbol = self.insert_symbol
+        reserved = frozenset(self.reserved_words_list)
+        binary = not isinstance(s, str)
+        invalid = False
+        for start, end, kind in zip(starts, ends, kinds):
+            pos = offset + start
+            if kind == R_BORDER:
+                emit((chr(data[start]) if binary else s[start], '', pos))
+                continue
+            text = s[start:end].decode('ascii') if binary else s[start:end]
+            if kind == R_WORD:
+                if text[0].isalpha():
+                    if end == slen:
+                        # 文件末尾没有结束符的单词被丢弃
+                        break
+                    if text in reserved:
+                        emit((text, '', pos))
+                    else:
+                        sym = symbol_table.get(text)
+                        emit(('id', insert_symbol(text) if sym is None else sym, pos))
+                elif NUMBER_RE.fullmatch(text) and (len(text) < 4 or text[0] == '0' or end == slen
+                                                    or RUN_CLASSES[data[end]] != R_OP):
+                    if end == slen:
+                        break
+                    if text[0] != '0':
+                        emit(('digit', int(text), pos))
+                    elif len(text) == 1:
+                        emit(('digit', 0, pos))
+                    elif text[1] == 'x':
+                        emit(('digit', int(text, 16), pos))
+                    else:
+                        emit(('digit', int(text, 8), pos))
+                else:
+                    invalid = True
+                    break
+            else:
+                ops = [(m.start(), m.group()) for m in OP_RE.finditer(text)]
+                if end == slen:
+                    ops.pop()
+                for op_start, op in ops:
+                    if op == '=':
+                        emit(('ASSIGN-OP', '=', pos + op_start))
+                    elif op[0] in '&|':
+                        emit(('LOGIC', op, pos + op_start))
+                    else:
+                        emit(('RELATION', op, pos + op_start))
+            if end == slen:
+                break
+            if data[end] == 9:
+                # 紧跟在单词后的制表符也作为记号
+                emit(('\t', '', offset + end))
+        if not invalid:
+            self.i = offset + slen - extra
+            return
+        # 不合法的数字，撤销已产生的记号和插入的符号，交给正则后端
+        del self.token_list[mark:]
+        for idx in range(symbol_idx, self.symbol_idx):
+            del symbol_table[self.symbol_table_id.pop(idx)]
+        self.symbol_idx = symbol_idx
+        self.regex_scanner(s, offset)
+
+    def run(self, filename, preprocess=False):
+        file = open(filename, encoding='utf8')
+        text = file.read()
+        self.print_line('origin data')
+
+        print(text)
+        self.source_map = None
+        if preprocess:
+            text, self.source_map = self.preprocess(text)
+            self.print_line('pre processed data')
+            print(text)
+
+        print()
+        self.scan(text)
+        if preprocess:
+            self.restore_positions()
+        self.print_line('lexical result')
+        for k, v, offset in self.token_list:
+            print((k, v, self.position(offset)))
+
+    def create_tokens(self, filename, use_mmap=False, preprocess=False):
+        self.source_map = None
+        if use_mmap and not preprocess:
+            text = self.map_file(filename)
+        else:
+            file = open(filename, encoding='utf8')
+            text = file.read()
+            if preprocess:
+                text, self.source_map = self.preprocess(text)
+        self.scan(text)
+        if isinstance(text, mmap.mmap):
+            text.close()
+        if preprocess:
+            self.restore_positions()
+        # create new token_list
+        return [self.convert_token(token) for token in self.token_list]
+
+    def map_file(self, filename):
+        # 只读映射源文件，由正则后端直接在字节上扫描，不必先解码成 str
+        file = open(filename, 'rb')
+        try:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            file.close()
+
+    def create_token_stream(self, filename, kinds=None, chunk_size=1 << 16):
+        # 流式扫描并直接写入紧凑的 TokenStream，不保留元组形式的记号列表
+        stream = TokenStream(kinds)
+        stream.extend(self.iter_tokens(filename, chunk_size=chunk_size))
+        return stream
+
+    def convert_token(self, token):
+        k, v, offset = token
+        pos = self.position(offset)
+        if v == '':
+            return k, '', pos
+        elif k == 'id':
+            return k, self.symbol_table_id[v], pos
+        elif k == 'digit':
+            return k, v, pos
+        else:
+            return v, '', pos
+
+    def find_cut(self, buf, lo=0):
+        # 寻找可以安全切分的位置：不在注释中、紧跟在 ; { } 后的换行之后，扫描到这里时状态机一定回到了状态 0
+        end = len(buf)
+        while True:
+            nl = buf.rfind('\n', lo, end)
+            if nl < 1:
+                return 0
+            if buf[nl - 1] in ';{}':
+                line_start = buf.rfind('\n', 0, nl - 1) + 1
+                if buf.find('//', line_start, nl) == -1:
+                    return nl + 1
+            end = nl
+
+    def iter_tokens(self, source, chunk_size=1 << 16):
+        # 分块读取并逐个产生记号，只保留当前块的 token_list
+        file = open(source, encoding='utf8') if isinstance(source, str) else source
+        self.source_map = None
+        buf = ''
+        offset = 0
+        try:
+            while True:
+                chunk = file.read(chunk_size)
+                if chunk:
+                    lo = len(buf)
+                    buf += chunk
+                    cut = self.find_cut(buf, lo)
+                    if cut == 0:
+                        continue
+                    segment, buf = buf[:cut], buf[cut:]
+                else:
+                    segment, buf = buf, ''
+                self.scan(segment, offset)
+                for token in self.token_list:
+                    yield self.convert_token(token)
+                self.token_list.clear()
+                if not chunk:
+                    return
+                offset = self.i
+        finally:
+            if file is not source:
+                file.close()
+
+    def relex(self, old_tokens, old_text, new_text, edit_range, window=1 << 12):
+        # 增量扫描：old_tokens 是本对象上一次 create_tokens / relex 对 old_text 的结果，
+        # edit_range=(start, end) 为 old_text 中被替换的区间
+        # 边界符产生后状态机回到状态 0，其后的扫描只取决于剩余文本，
+        # 因此从编辑点之前最近的边界符续扫，直到新旧记号在编辑点之后的同一个边界符处重合，
+        # 其余的旧记号只需平移偏移和行列号
+        start, end = edit_range
+        delta = len(new_text) - len(old_text)
+        new_end = end + delta
+        old_raw = self.token_list
+        if len(old_raw) != len(old_tokens):
+            raise ValueError('old_tokens do not come from the last scan of this lexer')
+        old_i, old_state = self.i, self.state
+        offsets = [token[2] for token in old_raw]
+
+        # 续扫起点：偏移 + 2 <= start 的最后一个边界符，后一个字符未被修改，
+        # 保证它不会和编辑后的内容组成注释
+        k = bisect_left(offsets, start - 1) - 1
+        while k >= 0 and old_raw[k][0] not in RESTART_TOKENS:
+            k -= 1
+        restart = offsets[k] + 1 if k >= 0 else 0
+
+        self.source_map = None
+        self.line_index = LineIndex(new_text)
+        limit = max(new_end + 2, restart) + window
+        while True:
+            self.token_list = []
+            self.state = 0
+            self.scan_backend(new_text[restart:limit], restart)
+            if limit >= len(new_text):
+                sync = None
+                break
+            sync = self.find_sync(old_raw, offsets, new_end, delta, limit)
+            if sync is not None:
+                break
+            limit += window
+            window *= 2
+
+        new_raw = self.token_list
+        if sync is None:
+            self.token_list = old_raw[:k + 1] + new_raw
+            return old_tokens[:k + 1] + [self.convert_token(token) for token in new_raw]
+
+        n, m = sync
+        tail = m + 1
+        raw_tail = old_raw[tail:]
+        tokens_tail = old_tokens[tail:]
+        if delta:
+            raw_tail = [(tk, attr, offset + delta) for tk, attr, offset in raw_tail]
+        # 编辑区之后的行号统一平移，与编辑区末尾同一行的记号还要平移列号
+        dline = new_text.count('\n', start, new_end) - old_text.count('\n', start, end)
+        dcol = (new_end - new_text.rfind('\n', 0, new_end)) - (end - old_text.rfind('\n', 0, end))
+        line_end = old_text.find('\n', end)
+        if line_end == -1:
+            line_end = len(old_text)
+        if dline or dcol:
+            tokens_tail = [(tk, attr, (pos[0] + dline, pos[1] + dcol if offset < line_end else pos[1]))
+                           if pos else (tk, attr, pos)
+                           for (tk, attr, pos), offset in zip(tokens_tail, offsets[tail:])]
+        self.token_list = old_raw[:k + 1] + new_raw[:n + 1] + raw_tail
+        self.i = old_i + delta
+        self.state = old_state
+        return (old_tokens[:k + 1] + [self.convert_token(token) for token in new_raw[:n + 1]]
+                + tokens_tail)
+
+    def find_sync(self, old_raw, old_offsets, new_end, delta, limit):
+        # 在新扫描出的记号中寻找编辑区之后、旧记号中同一位置也产生过的边界符，
+        # 窗口末尾两个字符之内的记号可能受截断影响，不作为同步点
+        for n, (tk, _, offset) in enumerate(self.token_list):
+            if offset < new_end:
+                continue
+            if offset + 2 >= limit:
+                return None
+            if tk not in RESTART_TOKENS:
+                continue
+            m = bisect_right(old_offsets, offset - delta) - 1
+            if m >= 0 and old_offsets[m] == offset - delta and old_raw[m][0] == tk:
+                return n, m
+        return None
+
+    def print_static_data(self):
+        self.print_line('statictics info')
+        print('total code lines', self.line_index.line_count())
+        print('total characters counts', self.i)
+        from collections import Counter
+        counter = Counter((k, v) for k, v, _ in self.token_list)
+        for elem, cnt in counter.items():
+            if elem[0] == 'id':
+                print(f'({self.symbol_table_id[elem[1]]}, {cnt})')
+            elif elem[1] != '':
+                print(f'({elem[0]}.{elem[1]}, {cnt})')
+            else:
+                print(f'({elem[0]}, {cnt})')
+
+    def in_border(self, c):
+        return c in self.border_char_list or c.isalnum() or c in ['=', '<', '>', '!', '&', '|']
+
+
+
+def compare_backends(filename, backend='regex'):
+    # 分别用状态机和另一个后端扫描同一文件，报告第一处不一致
+    dfa_tokens = Lex('dfa').create_tokens(filename)
+    other_lex = Lex(backend)
+    other_tokens = other_lex.create_tokens(filename)
+    for idx, (a, b) in enumerate(zip(dfa_tokens, other_tokens)):
+        if a != b:
+            print(f'backends diverge at token {idx}: dfa {a}, {backend} {b}')
+            return idx
+    if len(dfa_tokens) != len(other_tokens):
+        idx = min(len(dfa_tokens), len(other_tokens))
+        print(f'backends diverge at token {idx}: dfa produced {len(dfa_tokens)} tokens, '
+              f'{backend} produced {len(other_tokens)}')
+        return idx
+    if other_lex.fallback:
+        print(f'backends agree on {len(dfa_tokens)} tokens ({backend} backend fell back to dfa)')
+    else:
+        print(f'backends agree on {len(dfa_tokens)} tokens')
+    return -1
+
+if __name__ == '__main__':
+    # file = open("./full_test.cpp", encoding='utssf8')
+    filepath = 'struct_test.cpp'
+    lex = Lex()
+    lex.run(filepath, preprocess=False)
+    # lex.print_static_data()
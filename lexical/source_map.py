@@ -0,0 +1,71 @@
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def newline_offsets(text, base=0):
+    # 所有换行之后一个字符的偏移，有 numpy 时整体比较一次，否则逐个 find
+    if np is not None and len(text):
+        if not isinstance(text, str):
+            buf = np.frombuffer(text, np.uint8)
+        elif text.isascii():
+            buf = np.frombuffer(text.encode('ascii'), np.uint8)
+        else:
+            # 按码点展开，偏移与 str 的下标一致
+            buf = np.frombuffer(text.encode('utf-32-le'), np.uint32)
+        found = np.flatnonzero(buf == 10)
+        del buf
+        found += base + 1
+        return array('I', found.astype(np.uint32).tobytes())
+    nl = b'\n' if not isinstance(text, str) else '\n'
+    starts = array('I')
+    find = text.find
+    i = find(nl)
+    while i != -1:
+        starts.append(base + i + 1)
+        i = find(nl, i + 1)
+    return starts
+
+
+class LineIndex:
+    # 每一行起始字符的下标，按需把字符偏移换算为 (行, 列)，行列均从 1 开始
+    def __init__(self, text=''):
+        self.starts = array('I', [0])
+        self.starts.extend(newline_offsets(text))
+
+    def extend(self, text, base):
+        # 追加从偏移 base 开始的一段文本，供分块扫描使用
+        self.starts.extend(newline_offsets(text, base))
+
+    def position(self, offset):
+        line = bisect_right(self.starts, offset)
+        return line, offset - self.starts[line - 1] + 1
+
+    def line_count(self):
+        return len(self.starts)
+
+
+class SourceMap:
+    # 预处理后的文本到原文的偏移映射
+    # 每个原样保留下来的原文片段记录一次 (输出中的起点, 原文中的起点)，片段之间是压缩掉的空白和注释
+    def __init__(self, text):
+        self.lines = LineIndex(text)
+        self.out_starts = array('I')
+        self.src_starts = array('I')
+
+    def add(self, out_start, src_start):
+        self.out_starts.append(out_start)
+        self.src_starts.append(src_start)
+
+    def to_source(self, offset):
+        k = bisect_right(self.out_starts, offset) - 1
+        if k < 0:
+            return offset
+        return self.src_starts[k] + offset - self.out_starts[k]
+
+    def position(self, offset):
+        return self.lines.position(self.to_source(offset))
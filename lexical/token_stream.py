@@ -0,0 +1,103 @@
+from array import array
+
+NO_ATTR = -1  # 属性为空串
+BIG_ATTR = -2  # 超出 32 位的整数常量，值保存在 TokenStream.big 中
+NO_POS = 0  # 行号为 0 表示没有位置，例如结束符 $
+
+
+class KindTable:
+    # 记号类别名与编号的双向映射，可以用文法的终结符预先填充，使编号在词法和语法分析之间共享
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        idx = self.ids.get(name)
+        if idx is None:
+            idx = len(self.names)
+            self.ids[name] = idx
+            self.names.append(name)
+        return idx
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+
+class TokenStream:
+    # 以列存储 (token, attribute, (line, row))：类别编号、属性/符号编号、行号、列号各占一个 array
+    def __init__(self, kinds=None):
+        self.kinds = kinds if kinds is not None else KindTable()
+        self.kind_ids = array('H')
+        self.attrs = array('i')
+        self.lines = array('I')
+        self.rows = array('I')
+        self.symbols = []
+        self.symbol_ids = {}
+        self.big = {}
+        self.id_kind = self.kinds.intern('id')
+        self.digit_kind = self.kinds.intern('digit')
+
+    def append(self, token):
+        kind, attr, pos = token
+        k = self.kinds.intern(kind)
+        if k == self.id_kind:
+            a = self.symbol_ids.get(attr)
+            if a is None:
+                a = len(self.symbols)
+                self.symbol_ids[attr] = a
+                self.symbols.append(attr)
+        elif k == self.digit_kind:
+            a = attr
+            if a >= 1 << 31:
+                self.big[len(self.kind_ids)] = a
+                a = BIG_ATTR
+        else:
+            a = NO_ATTR
+        self.kind_ids.append(k)
+        self.attrs.append(a)
+        if pos:
+            self.lines.append(pos[0])
+            self.rows.append(pos[1])
+        else:
+            self.lines.append(NO_POS)
+            self.rows.append(NO_POS)
+
+    def extend(self, tokens):
+        for token in tokens:
+            self.append(token)
+
+    def __len__(self):
+        return len(self.kind_ids)
+
+    def decode(self, idx, k, a, line, row):
+        pos = (line, row) if line != NO_POS else ''
+        if a == NO_ATTR:
+            return self.kinds.names[k], '', pos
+        if k == self.id_kind:
+            return 'id', self.symbols[a], pos
+        if a == BIG_ATTR:
+            a = self.big[idx]
+        return self.kinds.names[k], a, pos
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        return self.decode(idx, self.kind_ids[idx], self.attrs[idx], self.lines[idx], self.rows[idx])
+
+    def __iter__(self):
+        decode = self.decode
+        for idx, (k, a, line, row) in enumerate(zip(self.kind_ids, self.attrs, self.lines, self.rows)):
+            yield decode(idx, k, a, line, row)
+
+    def kind_name(self, idx):
+        return self.kinds.names[self.kind_ids[idx]]
+
+    def nbytes(self):
+        return sum(arr.itemsize * len(arr) for arr in (self.kind_ids, self.attrs, self.lines, self.rows))
@@ -98,26 +98,37 @@ class Variable:
 
 
 class VariableManager:
+    # bindings 记录每个名字所在的作用域栈，栈顶即最近的定义
     def __init__(self):
         self.variables = {}
+        self.bindings = {}
 
     def contains(self, scope, v):
         return scope in self.variables and v in self.variables[scope]
 
     def delete_scope(self, scope):
+        self.exit_scope(scope)
         del self.variables[scope]
 
     def delete_variable(self, scope, v):
         del self.variables[scope][v]
+        stack = self.bindings[v]
+        if stack and stack[-1] == scope:
+            stack.pop()
+
+    def exit_scope(self, scope):
+        for v in self.variables.get(scope, ()):
+            self.bindings[v].pop()
 
     def get_variable(self, scope, v):
         return self.variables[scope][v]
 
-    def find_variable(self, scope_list, v):
-        for scope in scope_list[::-1]:
-            if self.contains(scope, v):
-                return scope, self.variables[scope][v]
-        return -1
+    def find_variable(self, v):
+        stack = self.bindings.get(v)
+        if not stack:
+            return -1
+        scope = stack[-1]
+        return scope, self.variables[scope][v]
 
     def add_variable(self, scope, v, tp, pos=(0, 0), struct_type=None):
         if self.contains(scope, v):
@@ -128,6 +139,7 @@ class VariableManager:
         if scope not in self.variables:
             self.variables[scope] = {}
         self.variables[scope][v] = Variable(tp=TYPE(tp), id=v, pos=pos, struct_type=struct_type)
+        self.bindings.setdefault(v, []).append(scope)
         return None
 
     def set_variable(self, scope, v, v_obj, pos):
@@ -228,11 +240,10 @@ class VariableManager:
     def set_struct_field(self, cur, var_name, var_list, pos):
         self.variables[cur][var_name] = var_list
 
-    def set_struct_attribute(self, cur, scopes, var_name, attribute, v_obj, pos):
-        _, stu = self.find_variable(scopes, var_name)
+    def set_struct_attribute(self, cur, stu, var_name, attribute, v_obj, pos):
         stu_type = stu.struct_type
         # check whether to assign
-        scope, field_list = self.find_variable(scopes, stu_type)
+        scope, field_list = self.find_variable(stu_type)
         for t in field_list:
             if t[1][0] == attribute:
                 if t[0] == v_obj.type:
@@ -303,11 +314,12 @@ class FunctionManager:
 
 
 class ScopeManager:
-    def __init__(self):
+    def __init__(self, variable_manager=None):
         self.scopes = []
         self.cur = 0
         self.gl = 0
         self.max_scope = 0
+        self.variable_manager = variable_manager
 
     def go_scope(self):
         self.max_scope += 1
@@ -315,6 +327,9 @@ class ScopeManager:
         self.scopes.append(self.cur)
 
     def out_scope(self):
+        # 弹出该作用域中各个名字的绑定
+        if self.variable_manager is not None:
+            self.variable_manager.exit_scope(self.cur)
         self.scopes.pop(-1)
         self.cur = self.scopes[-1]
 
@@ -338,11 +353,13 @@ class Semantic:
         self.error_manager = ErrorManager()
         self.variable_manager = VariableManager()
         self.function_manager = FunctionManager()
-        self.scope_manager = ScopeManager()
+        self.scope_manager = ScopeManager(self.variable_manager)
         self.init_function_manager()
 
-    def run(self):
-        self.tree.print()
+    def run(self, pr=False):
+        # 只在需要时打印分析树
+        if pr:
+            self.tree.print()
         self.proc_program(self.tree.root)
 
     def proc_program(self, root):
@@ -351,9 +368,10 @@ class Semantic:
         self.proc_func_or_dec_list(root.child[0])
 
     def proc_func_or_dec_list(self, node):
-        if node.child[0].is_valid():
+        # 列表类产生式是右递归的，沿闭包循环，避免递归深度随声明个数增长
+        while node.child[0].is_valid():
             self.proc_func_or_dec(node.child[0])
-            self.proc_func_or_dec_list(node.child[1])
+            node = node.child[1]
 
     def proc_func_or_dec(self, node):
         if node.child[0].data == '类型变量':
@@ -412,14 +430,11 @@ class Semantic:
             self.proc_global_var_closure(node.child[0], tp)
 
     def proc_global_var_closure(self, node, tp):
-        for child in node.child:
-            if child.data == ';':
-                break
-            elif child.data == '变量':
-                var_name, pos, _ = self.proc_var(child)
-                self.variable_manager.add_variable(self.scope_manager.cur, var_name, tp, pos)
-            elif child.data == '全局变量闭包':
-                self.proc_global_var_closure(child, tp)
+        # <全局变量闭包> -> [,]<变量><全局变量闭包> | [;]
+        while node.child[0].data == ',':
+            var_name, pos, _ = self.proc_var(node.child[1])
+            self.variable_manager.add_variable(self.scope_manager.cur, var_name, tp, pos)
+            node = node.child[2]
 
     def proc_param_dec(self, node):
         params = []
@@ -460,15 +475,14 @@ class Semantic:
         return self.proc_factor_exp_closure(node.child[1], v_obj)
 
     def proc_item(self, node, item):
-        if node.child[0].is_valid():
+        while node.child[0].is_valid():
             v_obj = self.proc_factor_item(node.child[1])
             item = self.variable_manager.op_variable(item, node.child[0].data, v_obj, node.child[0].pos)
-            item = self.proc_item(node.child[2], item)
-            return item
+            node = node.child[2]
         return item
 
     def find_near_variable(self, var_name):
-        return self.variable_manager.find_variable(self.scope_manager.scopes, var_name)
+        return self.variable_manager.find_variable(var_name)
 
     def proc_factor_exp(self, node):
         if node.child[0].is_terminal():  # (表达式)
@@ -482,13 +496,13 @@ class Semantic:
         elif node.child[0].data == '变量':
             var_name, pos, attr = self.proc_var(node.child[0])
             if not node.child[1].child[0].is_valid():
-                if not self.var_defined(var_name):
+                found = self.find_near_variable(var_name)
+                if found == -1:
                     return None
+                _, v_obj = found
                 if attr is None:
-                    _, v_obj = self.find_near_variable(var_name)
                     return v_obj
                 else:
-                    _, v_obj = self.find_near_variable(var_name)
                     v_attr = v_obj.val[attr]
                     return v_attr
             else:
@@ -508,13 +522,11 @@ class Semantic:
                 return Variable(tp=func.ret_type)
 
     def proc_factor_exp_closure(self, node, factor_exp):
-        if node.child[0].is_valid():
+        while node.child[0].is_valid():
             v_obj = self.proc_factor_exp(node.child[1])
             factor_exp = self.variable_manager.op_variable(factor_exp, node.child[0].data, v_obj, node.child[0].pos)
-            factor_exp = self.proc_factor_exp_closure(node.child[2], factor_exp)
-            return factor_exp
-        else:
-            return factor_exp
+            node = node.child[2]
+        return factor_exp
 
     def proc_digit(self, node):
         return node.child[0].symbol
@@ -542,13 +554,11 @@ class Semantic:
             return self.proc_digit(node.child[0])
 
     def proc_param_closure(self, node, v_obj_list):
-        if node.child[0].data == ',':
+        while node.child[0].data == ',':
             val = self.proc_param(node.child[1])
             v_obj_list.append(val)
-
-            return self.proc_param_closure(node.child[2], v_obj_list)
-        else:
-            return v_obj_list
+            node = node.child[2]
+        return v_obj_list
 
     def proc_func_impl(self, node):
         if node.child[0].data == ';':
@@ -562,31 +572,32 @@ class Semantic:
         self.proc_func_body_closure(node.child[0])
 
     def proc_func_body_closure(self, node):
-
-        if node.child[0].data == '声明语句':
-            self.proc_dec_stmt(node.child[0])
-        elif node.child[0].data == '赋值函数':
-            self.proc_assign_func(node.child[0])
-        elif node.child[0].data == 'while循环':
-            self.proc_while_loop(node.child[0])
-        elif node.child[0].data == 'if语句':
-            self.proc_if_stmt(node.child[0])
-        elif node.child[0].data == '空语句':
-            self.proc_empty_stmt(node.child[0])
-        elif node.child[0].data == 'return语句':
-            self.proc_return_stmt(node.child[0])
-        elif node.child[0].data == '结构体域声明语句':
-            self.proc_struct_field_stmt(node.child[0])
-        elif not node.child[0].is_valid():
-            return
-        self.proc_func_body_closure(node.child[1])
+        # 每条语句处理完后沿闭包继续，只有嵌套的代码块才会递归
+        while True:
+            if node.child[0].data == '声明语句':
+                self.proc_dec_stmt(node.child[0])
+            elif node.child[0].data == '赋值函数':
+                self.proc_assign_func(node.child[0])
+            elif node.child[0].data == 'while循环':
+                self.proc_while_loop(node.child[0])
+            elif node.child[0].data == 'if语句':
+                self.proc_if_stmt(node.child[0])
+            elif node.child[0].data == '空语句':
+                self.proc_empty_stmt(node.child[0])
+            elif node.child[0].data == 'return语句':
+                self.proc_return_stmt(node.child[0])
+            elif node.child[0].data == '结构体域声明语句':
+                self.proc_struct_field_stmt(node.child[0])
+            elif not node.child[0].is_valid():
+                return
+            node = node.child[1]
 
     def proc_dec_stmt(self, node):
         tp, val = self.proc_dec(node.child[0])
         self.proc_multi_var_dec_closure(node.child[1], tp)
 
     def var_defined(self, val_name):
-        return self.variable_manager.find_variable(self.scope_manager.scopes, val_name) != -1
+        return self.variable_manager.find_variable(val_name) != -1
 
     def proc_assign_func(self, node):
         var_name, pos, attribute = self.proc_var(node.child[0])
@@ -620,10 +631,9 @@ class Semantic:
         return v_obj
 
     def proc_multi_var_dec_closure(self, node, tp):
-        if not node.child[0].is_valid():
-            return
-        self.proc_multi_var_dec(node.child[1], tp)
-        self.proc_multi_var_dec_closure(node.child[2], tp)
+        while node.child[0].is_valid():
+            self.proc_multi_var_dec(node.child[1], tp)
+            node = node.child[2]
 
     def proc_multi_var_dec(self, node, tp):
         var, pos, attr = self.proc_var(node.child[0])
@@ -631,14 +641,13 @@ class Semantic:
         self.proc_init_value(node.child[1], var)
 
     def assign_value(self, var_name, v_obj, pos):
-        target_scope, _ = self.variable_manager.find_variable(self.scope_manager.scopes, var_name)
+        target_scope, _ = self.variable_manager.find_variable(var_name)
         self.variable_manager.set_variable(target_scope, var_name, v_obj, pos)
 
     def assign_struct_value(self, var_name, v_obj, attribute, pos):
-        target_scope, _ = self.variable_manager.find_variable(self.scope_manager.scopes, var_name)
+        target_scope, stu = self.variable_manager.find_variable(var_name)
         # self.variable_manager.set_variable(target_scope, var_name, v_obj, pos)
-        self.variable_manager.set_struct_attribute(target_scope, self.scope_manager.scopes, var_name, attribute, v_obj,
-                                                   pos)
+        self.variable_manager.set_struct_attribute(target_scope, stu, var_name, attribute, v_obj, pos)
 
     def proc_assign_or_func_call(self, node, var_name, attribute):
         if node.child[0].data == '=':
@@ -665,11 +674,10 @@ class Semantic:
                     return None
 
     def proc_dec_closure(self, node, param_list):
-        if node.child[0].is_valid():
+        while node.child[0].is_valid():
             param_list.append(self.proc_dec(node.child[1]))
-            return self.proc_dec_closure(node.child[2], param_list)
-        else:
-            return param_list
+            node = node.child[2]
+        return param_list
 
     def proc_logic_exp(self, node):
         if node.child[0].data == '!':
@@ -731,12 +739,10 @@ class Semantic:
         self.set_struct_field(var_name, var_list, pos)
 
     def proc_struct_filed_list(self, node, var_list):
-        if node.child[0].is_valid():
-            # print(node)
+        while node.child[0].is_valid():
             var_type, var_name = self.proc_struct_field_var(node.child[0])
             var_list.append((TYPE(var_type), var_name))
-            self.proc_struct_filed_list(node.child[1], var_list)
-            return var_list
+            node = node.child[1]
         return var_list
 
     def proc_struct_field_var(self, node):
@@ -814,7 +820,7 @@ if __name__ == '__main__':
 
     else:
         semantic = Semantic(grammar.tree)
-        semantic.run()
+        semantic.run(pr=True)
 
         semantic.print_variable_table()
         semantic.print_function_table()
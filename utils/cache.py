@@ -0,0 +1,106 @@
+import hashlib
+import marshal
+import os
+import time
+
+MAGIC = b'ECC\x01'
+MARSHAL_VERSION = 4
+# 编译器自身的源码也参与计算缓存键，修改编译器后旧的缓存自然失效
+COMPILER_DIRS = ('lexical', 'grammar', 'instruction', 'utils')
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_compiler_version = None
+
+
+def compiler_version():
+    global _compiler_version
+    if _compiler_version is None:
+        h = hashlib.sha256()
+        for d in COMPILER_DIRS:
+            path = os.path.join(ROOT_DIR, d)
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.py'):
+                    with open(os.path.join(path, name), 'rb') as f:
+                        h.update(f'{d}/{name}\0'.encode('utf8'))
+                        h.update(f.read())
+        _compiler_version = h.hexdigest()
+    return _compiler_version
+
+
+class CompileCache:
+    # 按内容寻址的编译缓存：键为源文件、文法文件和编译器版本的哈希，
+    # 每个阶段的结果单独存为一个 <key>.<phase> 文件，内容为 marshal 编码的内置类型
+    # 读取时更新文件的修改时间，目录总大小超过 max_bytes 时按最近最少使用的顺序删除
+    def __init__(self, root='./cache', max_bytes=64 << 20):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, *paths):
+        h = hashlib.sha256(compiler_version().encode('ascii'))
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            h.update(len(data).to_bytes(8, 'little'))
+            h.update(data)
+        return h.hexdigest()
+
+    def path(self, key, phase):
+        return os.path.join(self.root, f'{key}.{phase}')
+
+    def get(self, key, phase):
+        path = self.path(key, phase)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        if data[:len(MAGIC)] != MAGIC:
+            self.misses += 1
+            return None
+        try:
+            value = marshal.loads(data[len(MAGIC):])
+        except (EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, phase, value):
+        data = MAGIC + marshal.dumps(value, MARSHAL_VERSION)
+        path = self.path(key, phase)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.name.endswith('.tmp') or not entry.is_file():
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size